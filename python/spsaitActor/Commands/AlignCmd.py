@@ -20,16 +20,16 @@ class AlignCmd(object):
         self.name = 'align'
         self.vocab = [
             ('slit',
-             'align <exptime> <position> [<fiber>] [<duplicate>] [<name>] [<comments>] [<head>] [<tail>]',
+             'align <exptime> <position> [<fiber>] [<duplicate>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.slitAlign),
             ('slit',
-             'throughfocus <exptime> <position> <cam> [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<name>] [<comments>] [<head>] [<tail>]',
+             'throughfocus <exptime> <position> <cam> [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.slitTF),
             ('detector',
-             'throughfocus <exptime> <position> <cam> [<tilt>] [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<waveRange>] [<name>] [<comments>] [<head>] [<tail>]',
+             'throughfocus <exptime> <position> <cam> [<tilt>] [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<waveRange>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.detAlign),
             ('detector',
-             'scan <exptime> <waveRange> [<duplicate>] [<cam>] [<name>] [<comments>] [<head>] [<tail>]', self.detScan),
+             'scan <exptime> <waveRange> [<duplicate>] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]', self.detScan),
         ]
 
         # Define typed command arguments for the above commands.
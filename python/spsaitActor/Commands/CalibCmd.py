@@ -18,12 +18,12 @@ class CalibCmd(object):
         #
         self.name = "calib"
         self.vocab = [
-            ('bias', '[<duplicate>] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+            ('bias', '[<duplicate>] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.doBias),
-            ('dark', '<exptime> [<duplicate>] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+            ('dark', '<exptime> [<duplicate>] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.doDarks),
             ('imstab',
-             '<exptime> <duration> <delay> [<duplicate>] [keepOn] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+             '<exptime> <duration> <delay> [<duplicate>] [keepOn] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.imstab)
         ]
 
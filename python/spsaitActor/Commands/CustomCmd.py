@@ -18,7 +18,7 @@ class CustomCmd(object):
         # passed a single argument, the parsed and typed command.
         #
         self.vocab = [
-            ('custom', '<sequence> [<name>] [<comments>]', self.customSequence),
+            ('custom', '<sequence> [<name>] [<comments>] [plan]', self.customSequence),
         ]
 
         # Define typed command arguments for the above commands.
@@ -20,7 +20,7 @@ class DefocusCmd(object):
         self.name = "defocus"
         self.vocab = [
             ('defocus',
-             '<exptime> <position> [<attenuator>] [<duplicate>] [<switchOn>] [<switchOff>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+             '<exptime> <position> [<attenuator>] [<duplicate>] [<switchOn>] [<switchOff>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.defocus)
         ]
 
@@ -19,10 +19,10 @@ class DitherCmd(object):
         self.name = "dither"
         self.vocab = [
             ('dither',
-             'flat <exptime> <pixels> <nbPosition> [<duplicate>] [switchOff] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+             'flat <exptime> <pixels> <nbPosition> [<duplicate>] [switchOff] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.ditherFlat),
             ('dither',
-             'psf <exptime> <pixels> [doMinus] [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<cam>] [<name>] [<head>] [<tail>] [<comments>]',
+             'psf <exptime> <pixels> [doMinus] [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<cam>] [<name>] [<head>] [<tail>] [<comments>] [plan]',
              self.ditherPsf)
 
         ]
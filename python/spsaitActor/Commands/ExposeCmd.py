@@ -19,10 +19,10 @@ class ExposeCmd(object):
         self.name = "expose"
         self.vocab = [
             ('expose',
-             'arc <exptime> [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+             'arc <exptime> [<duplicate>] [<switchOn>] [<switchOff>] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.doArc),
             ('expose',
-             'flat <exptime> [<duplicate>] [switchOff] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>]',
+             'flat <exptime> [<duplicate>] [switchOff] [<attenuator>] [force] [<cam>] [<name>] [<comments>] [<head>] [<tail>] [plan]',
              self.doArc),
         ]
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+
+import opscore.protocols.keys as keys
+import opscore.protocols.types as types
+from spsaitActor.utils import cleanStr, singleShot
+
+
+class QueueCmd(object):
+    # queued experiments can last for days, the abort command is the way to interrupt them.
+    timeLim = 7 * 24 * 3600
+
+    def __init__(self, actor):
+        # This lets us access the rest of the actor.
+        self.actor = actor
+
+        # Declare the commands we implement. When the actor is started
+        # these are registered with the parser, which will call the
+        # associated methods when matched. The callbacks will be
+        # passed a single argument, the parsed and typed command.
+        #
+        self.vocab = [
+            ('queue', 'add <experiment>', self.add),
+            ('queue', 'list', self.list),
+            ('queue', 'remove <queueId>', self.remove),
+            ('queue', 'reorder <queueId> <position>', self.reorder),
+            ('queue', 'run', self.run),
+        ]
+
+        # Define typed command arguments for the above commands.
+        self.keys = keys.KeysDictionary("spsait_queue", (1, 1),
+                                        keys.Key("experiment", types.String(),
+                                                 help='spsait command to queue, ie "bias duplicate=15"'),
+                                        keys.Key("queueId", types.Int(), help='queued experiment id'),
+                                        keys.Key("position", types.Int(), help='new position, 0 runs next'),
+                                        )
+
+    @property
+    def queue(self):
+        return self.actor.queue
+
+    def add(self, cmd):
+        cmdKeys = cmd.cmd.keywords
+        self.queue.add(cmdKeys['experiment'].values[0].strip())
+
+        self.list(cmd)
+
+    def list(self, cmd):
+        for position, item in enumerate(self.queue.items):
+            cmd.inform('queued=%d,%d,"%s"' % (position, item['id'], cleanStr(item['cmdStr'])))
+
+        cmd.finish('queueLength=%d' % len(self.queue))
+
+    def remove(self, cmd):
+        cmdKeys = cmd.cmd.keywords
+        self.queue.remove(cmdKeys['queueId'].values[0])
+
+        self.list(cmd)
+
+    def reorder(self, cmd):
+        cmdKeys = cmd.cmd.keywords
+        self.queue.reorder(cmdKeys['queueId'].values[0], position=cmdKeys['position'].values[0])
+
+        self.list(cmd)
+
+    @singleShot
+    def run(self, cmd):
+        """Run queued experiments back to back, stop on abort or as soon as one of them fails."""
+        with self.queue.lock:
+            if self.queue.running:
+                raise RuntimeError('queue is already running')
+            self.queue.running = True
+
+        self.actor.resetSequence()
+
+        try:
+            while not self.actor.doStop:
+                item = self.queue.pop()
+                if item is None:
+                    break
+
+                cmd.inform('queueRunning=%d,"%s"' % (item['id'], cleanStr(item['cmdStr'])))
+                cmdVar = self.actor.cmdr.call(actor=self.actor.name, cmdStr=item['cmdStr'], forUserCmd=cmd,
+                                              timeLim=self.timeLim)
+                if cmdVar.didFail:
+                    cmd.fail('text="queueId=%d has failed, %d experiment(s) left in the queue"' % (item['id'],
+                                                                                                len(self.queue)))
+                    return
+        finally:
+            self.queue.running = False
+
+        if self.actor.doStop:
+            cmd.fail('text="queue aborted, %d experiment(s) left in the queue"' % len(self.queue))
+            return
+
+        cmd.finish('queueLength=%d' % len(self.queue))
@@ -19,11 +19,11 @@ class SacCmd(object):
         self.name = "sac"
         self.vocab = [
             ('sac',
-             '@(expose|background) <exptime> [<duplicate>] [<name>] [<comments>] [<head>] [<tail>]', self.expose),
+             '@(expose|background) <exptime> [<duplicate>] [<name>] [<comments>] [<head>] [<tail>] [plan]', self.expose),
             ('sac',
-             'align <exptime> <position> <focus> [<duplicate>] [<name>] [<comments>] [<head>] [<tail>]', self.sacAlign),
+             'align <exptime> <position> <focus> [<duplicate>] [<name>] [<comments>] [<head>] [<tail>] [plan]', self.sacAlign),
             ('sac',
-             'throughfocus <exptime> <position> [<duplicate>] [<name>] [<comments>] [<head>] [<tail>]', self.sacTF),
+             'throughfocus <exptime> <position> [<duplicate>] [<name>] [<comments>] [<head>] [<tail>] [plan]', self.sacTF),
         ]
 
         # Define typed command arguments for the above commands.
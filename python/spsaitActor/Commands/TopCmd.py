@@ -5,8 +5,11 @@ import time
 
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
-from spsaitActor.utils import singleShot
+import spsaitActor.utils.export as export
+import spsaitActor.utils.storage as storage
+from spsaitActor.utils import cleanStr, singleShot
 from spsaitActor.utils.logbook import Logbook
+from spsaitActor.utils.lookup import experimentFromVisit
 
 
 class TopCmd(object):
@@ -22,19 +25,32 @@ class TopCmd(object):
         self.vocab = [
             ('ping', '', self.ping),
             ('status', '', self.status),
-            ('abort', '', self.abort),
+            ('abort', '[<experimentId>] [<dbname>]', self.abort),
             ('logbook', '<dbname> <experimentId> [<name>] [<comments>] [<anomalies>]', self.setColumnValue),
-            ('wait', '<time>', self.wait)
+            ('logbook', 'query [<dbname>] [<seqtype>] [<since>] [<until>] [<name>] [<visitRange>]', self.query),
+            ('logbook', '<visit>', self.visitLookup),
+            ('logbook', 'export <dbname> <outdir> [<format>] [full]', self.exportLogbook),
+            ('wait', '<time>', self.wait),
+            ('resume', '<experimentId> [<dbname>]', self.resume),
+            ('plan', 'run <planId>', self.runPlan),
         ]
 
         # Define typed command arguments for the above commands.
         self.keys = keys.KeysDictionary("spsait_spsait", (1, 1),
                                         keys.Key("dbname", types.String(), help='dbname'),
-                                        keys.Key("experimentId", types.Int(), help="experimentId to update"),
+                                        keys.Key("experimentId", types.Int(), help="experimentId"),
                                         keys.Key("name", types.String(), help='experiment name'),
                                         keys.Key("comments", types.String(), help='experiment comments'),
                                         keys.Key("anomalies", types.String(), help='anomalies message'),
                                         keys.Key("time", types.Int(), help="time to wait"),
+                                        keys.Key("seqtype", types.String(), help='experiment type'),
+                                        keys.Key("since", types.String(), help='startdate lower bound (isoformat)'),
+                                        keys.Key("until", types.String(), help='startdate upper bound (isoformat)'),
+                                        keys.Key("visitRange", types.Int() * (2,), help='visitStart visitEnd'),
+                                        keys.Key("visit", types.Int(), help='visit to look up'),
+                                        keys.Key("outdir", types.String(), help='export directory'),
+                                        keys.Key("format", types.String(), help='parquet|arrow|npz'),
+                                        keys.Key("planId", types.Int(), help='plan to run'),
                                         )
 
     def ping(self, cmd):
@@ -50,8 +66,17 @@ class TopCmd(object):
         cmd.finish()
 
     def abort(self, cmd):
-        self.actor.doStop = True
-        self.actor.cmdr.call(actor='sps', cmdStr='exposure abort', forUserCmd=cmd)
+        cmdKeys = cmd.cmd.keywords
+        experimentId = cmdKeys['experimentId'].values[0] if 'experimentId' in cmdKeys else None
+        dbname = cmdKeys['dbname'].values[0] if 'dbname' in cmdKeys else None
+
+        experiments = self.actor.abort(experimentId=experimentId, dbname=dbname)
+        if experimentId is not None and not experiments:
+            cmd.fail('text="experimentId=%d is not running"' % experimentId)
+            return
+
+        if experimentId is None or any(['sps' in experiment.resources for experiment in experiments]):
+            self.actor.cmdr.call(actor='sps', cmdStr='exposure abort', forUserCmd=cmd)
 
         cmd.finish("text='Aborting'")
 
@@ -74,6 +99,82 @@ class TopCmd(object):
 
         cmd.finish()
 
+    @singleShot
+    def query(self, cmd):
+        cmdKeys = cmd.cmd.keywords
+        dbnames = [cmdKeys['dbname'].values[0]] if 'dbname' in cmdKeys else storage.databases()
+        visitStart, visitEnd = cmdKeys['visitRange'].values if 'visitRange' in cmdKeys else (None, None)
+        nbRows = 0
+
+        for dbname in dbnames:
+            pages = Logbook.queryExperiments(dbname=dbname,
+                                             seqtype=cmdKeys['seqtype'].values[0] if 'seqtype' in cmdKeys else None,
+                                             since=cmdKeys['since'].values[0] if 'since' in cmdKeys else None,
+                                             until=cmdKeys['until'].values[0] if 'until' in cmdKeys else None,
+                                             name=cmdKeys['name'].values[0] if 'name' in cmdKeys else None,
+                                             visitStart=visitStart,
+                                             visitEnd=visitEnd)
+
+            for page, rows in enumerate(pages):
+                for experimentId, name, __, __, seqtype, cmdStr, comments, __, __, __ in rows:
+                    cmd.inform('experiment=%s,%d,%s,"%s","%s","%s"' % (dbname, experimentId, seqtype,
+                                                                       cleanStr(cmdStr), cleanStr(name),
+                                                                       cleanStr(comments)))
+                nbRows += len(rows)
+                cmd.inform('queryPage=%s,%d,%d' % (dbname, page, len(rows)))
+
+        cmd.finish('queryResult=%d' % nbRows)
+
+    @singleShot
+    def visitLookup(self, cmd):
+        cmdKeys = cmd.cmd.keywords
+        visit = cmdKeys['visit'].values[0]
+        experiments = experimentFromVisit(visit)
+
+        for dbname, experimentId in experiments:
+            cmd.inform('visitExperiment=%d,%s,%d' % (visit, dbname, experimentId))
+
+        if not experiments:
+            cmd.fail('text="no experiment found for visit %d"' % visit)
+            return
+
+        cmd.finish()
+
+    @singleShot
+    def exportLogbook(self, cmd):
+        cmdKeys = cmd.cmd.keywords
+        dbname = cmdKeys['dbname'].values[0]
+        outdir = cmdKeys['outdir'].values[0]
+        fmt = cmdKeys['format'].values[0] if 'format' in cmdKeys else 'parquet'
+
+        if fmt not in export.extensions:
+            raise ValueError('unknown format : %s' % fmt)
+
+        exported = export.export(dbname, outdir, fmt=fmt, incremental='full' not in cmdKeys)
+
+        for table, nRows in exported.items():
+            cmd.inform('exported=%s,%s,%d' % (dbname, table, nRows))
+
+        cmd.finish()
+
+    @singleShot
+    def resume(self, cmd):
+        self.actor.resetSequence()
+        cmdKeys = cmd.cmd.keywords
+        experimentId = cmdKeys['experimentId'].values[0]
+        dbname = cmdKeys['dbname'].values[0] if 'dbname' in cmdKeys else None
+
+        self.actor.resumeExperiment(cmd, experimentId=experimentId, dbname=dbname)
+        cmd.finish()
+
+    @singleShot
+    def runPlan(self, cmd):
+        self.actor.resetSequence()
+        cmdKeys = cmd.cmd.keywords
+
+        self.actor.runPlan(cmd, planId=cmdKeys['planId'].values[0])
+        cmd.finish()
+
     @singleShot
     def wait(self, cmd):
         self.actor.resetSequence()
@@ -3,7 +3,7 @@ from collections import OrderedDict
 
 import numpy as np
 from actorcore.QThread import QThread
-from spsaitActor.utils.sequencing import CmdList
+from spsaitActor.utils.sequencing import CmdList, LazyCmdList, rebuildable
 
 
 class align(QThread):
@@ -49,11 +49,13 @@ class align(QThread):
         seq = CmdList()
 
         for focus in positions:
-            for enuActor in enuActors:
-                enuKeys = self.actor.models[enuActor].keyVarDict
-                posAbsolute = [focus] + list(enuKeys['slit'])[1:]
-                posAbsolute = ' '.join(['%s=%.5f' % (name, value) for name, value in zip(align.posName, posAbsolute)])
-                seq.addSubCmd(actor=enuActor, cmdStr='slit move absolute %s' % posAbsolute)
+            with seq.parallel():
+                for enuActor in enuActors:
+                    enuKeys = self.actor.models[enuActor].keyVarDict
+                    posAbsolute = [focus] + list(enuKeys['slit'])[1:]
+                    posAbsolute = ' '.join(['%s=%.5f' % (name, value)
+                                            for name, value in zip(align.posName, posAbsolute)])
+                    seq.addSubCmd(actor=enuActor, cmdStr='slit move absolute %s' % posAbsolute)
 
             seq.addSubCmd(actor='sps',
                           cmdStr='expose arc exptime=%.2f %s' % (exptime, cams),
@@ -62,25 +64,31 @@ class align(QThread):
 
         return seq
 
+    @rebuildable
     def detalign(self, exptime, cam, lowBound, upBound, nbPosition, tilt, duplicate, waveRange):
-        seq = CmdList()
+        # tilt is journaled as a list when the sequence is rebuilt.
+        tilt = np.asarray(tilt)
         xcuActor = 'xcu_%s' % cam
         upBound -= tilt.max()
         positions = np.linspace(lowBound, upBound, nbPosition)
 
-        for position in positions:
-            posA, posB, posC = np.ones(3) * position + tilt
-            seq.addSubCmd(actor=xcuActor,
-                          cmdStr='motors moveCcd a=%i b=%i c=%i microns abs' % (posA, posB, posC))
-            if not waveRange:
-                seq.addSubCmd(actor='sps',
-                              cmdStr='expose arc exptime=%.2f cam=%s' % (exptime, cam),
-                              duplicate=duplicate,
-                              timeLim=120 + exptime)
-            else:
-                seq.extend(self.detScan(exptime, [cam], duplicate, *waveRange))
-
-        return seq
+        def generator():
+            for position in positions:
+                seq = CmdList()
+                posA, posB, posC = np.ones(3) * position + tilt
+                seq.addSubCmd(actor=xcuActor,
+                              cmdStr='motors moveCcd a=%i b=%i c=%i microns abs' % (posA, posB, posC))
+                if not waveRange:
+                    seq.addSubCmd(actor='sps',
+                                  cmdStr='expose arc exptime=%.2f cam=%s' % (exptime, cam),
+                                  duplicate=duplicate,
+                                  timeLim=120 + exptime)
+                else:
+                    seq.extend(self.detScan(exptime, [cam], duplicate, *waveRange))
+                yield from seq
+
+        stepsPerPosition = duplicate if not waveRange else int(waveRange[2]) * (1 + duplicate)
+        return LazyCmdList(generator, length=nbPosition * (1 + stepsPerPosition))
 
     def detScan(self, exptime, cams, duplicate, waveStart, waveEnd, waveNb):
         cams = 'cams=%s' % ','.join(cams) if cams else ''
@@ -1,7 +1,7 @@
 import logging
 
 from actorcore.QThread import QThread
-from spsaitActor.utils.sequencing import CmdList
+from spsaitActor.utils.sequencing import CmdList, LazyCmdList, rebuildable
 
 
 class calib(QThread):
@@ -32,28 +32,32 @@ class calib(QThread):
                       timeLim=120 + exptime)
         return seq
 
+    @rebuildable
     def imstab(self, exptime, duration, delay, duplicate, cams, keepOn, switchOn, attenuator, force):
         cams = 'cams=%s' % ','.join(cams) if cams else ''
-        seq = CmdList()
         nbPosition = int(duration / delay) + 1
 
-        for i in range(nbPosition):
-            tempo = 0 if i == (nbPosition - 1) else delay * 3600
-            cmdOn = 'arc on=%s %s %s' % (','.join(switchOn), attenuator, force) if switchOn else 'status'
-            seq.addSubCmd(actor='dcb',
-                          cmdStr=cmdOn,
-                          timeLim=300)
+        def generator():
+            for i in range(nbPosition):
+                seq = CmdList()
+                tempo = 0 if i == (nbPosition - 1) else delay * 3600
+                cmdOn = 'arc on=%s %s %s' % (','.join(switchOn), attenuator, force) if switchOn else 'status'
+                seq.addSubCmd(actor='dcb',
+                              cmdStr=cmdOn,
+                              timeLim=300)
 
-            seq.addSubCmd(actor='sps',
-                          cmdStr='expose arc exptime=%.2f %s' % (exptime, cams),
-                          timeLim=120 + exptime,
-                          duplicate=duplicate)
+                seq.addSubCmd(actor='sps',
+                              cmdStr='expose arc exptime=%.2f %s' % (exptime, cams),
+                              timeLim=120 + exptime,
+                              duplicate=duplicate)
 
-            cmdOff = 'arc off=%s' % ','.join(switchOn) if not keepOn else 'status'
-            seq.addSubCmd(actor='dcb',
-                          cmdStr=cmdOff,
-                          tempo=tempo)
-        return seq
+                cmdOff = 'arc off=%s' % ','.join(switchOn) if not keepOn else 'status'
+                seq.addSubCmd(actor='dcb',
+                              cmdStr=cmdOff,
+                              tempo=tempo)
+                yield from seq
+
+        return LazyCmdList(generator, length=nbPosition * (2 + duplicate))
 
     def start(self, cmd=None):
         QThread.start(self)
@@ -29,25 +29,28 @@ class defocus(QThread):
         for focus in positions:
             cexptime, catten = defocused_exposure_times_single_position(exp_time_0=exptime, defocused_value=focus,
                                                                         att_value_0=attenuator)
-            if attenuator is not None:
-                seq.addSubCmd(actor='dcb', cmdStr='labsphere attenuator=%d' % catten)
+            with seq.parallel():
+                if attenuator is not None:
+                    seq.addSubCmd(actor='dcb', cmdStr='labsphere attenuator=%d' % catten)
 
-            for enuActor in enuActors:
-                enuKeys = self.actor.models[enuActor].keyVarDict
-                posAbsolute = [focus] + list(enuKeys['slit'])[1:]
-                posAbsolute = ' '.join(['%s=%.5f' % (name, value) for name, value in zip(defocus.posName, posAbsolute)])
-                seq.addSubCmd(actor=enuActor, cmdStr='slit move absolute %s' % posAbsolute)
+                for enuActor in enuActors:
+                    enuKeys = self.actor.models[enuActor].keyVarDict
+                    posAbsolute = [focus] + list(enuKeys['slit'])[1:]
+                    posAbsolute = ' '.join(['%s=%.5f' % (name, value)
+                                            for name, value in zip(defocus.posName, posAbsolute)])
+                    seq.addSubCmd(actor=enuActor, cmdStr='slit move absolute %s' % posAbsolute)
 
             seq.addSubCmd(actor='sps',
                           cmdStr='expose arc exptime=%.2f %s' % (cexptime, cams),
                           timeLim=120 + cexptime,
                           duplicate=duplicate)
 
-        for enuActor in enuActors:
-            enuKeys = self.actor.models[enuActor].keyVarDict
-            posAbsolute = [0] + list(enuKeys['slit'])[1:]
-            posAbsolute = ' '.join(['%s=%.5f' % (name, value) for name, value in zip(defocus.posName, posAbsolute)])
-            seq.addSubCmd(actor=enuActor, cmdStr='slit move absolute %s' % posAbsolute)
+        with seq.parallel():
+            for enuActor in enuActors:
+                enuKeys = self.actor.models[enuActor].keyVarDict
+                posAbsolute = [0] + list(enuKeys['slit'])[1:]
+                posAbsolute = ' '.join(['%s=%.5f' % (name, value) for name, value in zip(defocus.posName, posAbsolute)])
+                seq.addSubCmd(actor=enuActor, cmdStr='slit move absolute %s' % posAbsolute)
 
         return seq
 
@@ -2,7 +2,7 @@ import logging
 from collections import OrderedDict
 
 from actorcore.QThread import QThread
-from spsaitActor.utils.sequencing import CmdList
+from spsaitActor.utils.sequencing import CmdList, LazyCmdList, rebuildable
 
 
 class dither(QThread):
@@ -27,8 +27,9 @@ class dither(QThread):
                       timeLim=120 + exptime,
                       duplicate=duplicate)
 
-        for enuActor in enuActors:
-            seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % (-nbPosition * shift))
+        with seq.parallel():
+            for enuActor in enuActors:
+                seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % (-nbPosition * shift))
 
         seq.addSubCmd(actor='sps',
                       cmdStr='expose flat exptime=%.2f %s' % (exptime, cams),
@@ -36,16 +37,18 @@ class dither(QThread):
                       duplicate=duplicate)
 
         for i in range(2 * nbPosition):
-            for enuActor in enuActors:
-                seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % shift)
+            with seq.parallel():
+                for enuActor in enuActors:
+                    seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % shift)
 
             seq.addSubCmd(actor='sps',
                           cmdStr='expose flat exptime=%.2f %s' % (exptime, cams),
                           timeLim=120 + exptime,
                           duplicate=duplicate)
 
-        for enuActor in enuActors:
-            seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % (-nbPosition * shift))
+        with seq.parallel():
+            for enuActor in enuActors:
+                seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % (-nbPosition * shift))
 
         seq.addSubCmd(actor='sps',
                       cmdStr='expose flat exptime=%.2f %s' % (exptime, cams),
@@ -54,32 +57,39 @@ class dither(QThread):
 
         return seq
 
+    @rebuildable
     def ditherpsf(self, exptime, cams, shift, doMinus, duplicate):
         specIds = list(OrderedDict.fromkeys([int(cam[1]) for cam in cams])) if cams else self.actor.specIds
         cams = 'cams=%s' % ','.join(cams) if cams else ''
         enuActors = ['enu_sm%i' % specId for specId in specIds]
 
-        seq = CmdList()
         end = int(1 / shift)
         start = -end + 1 if doMinus else 0
 
-        for yn in range(start, end):
-            for zn in range(start, end):
-
+        def generator():
+            for yn in range(start, end):
+                for zn in range(start, end):
+                    seq = CmdList()
+                    with seq.parallel():
+                        for enuActor in enuActors:
+                            seq.addSubCmd(actor=enuActor, cmdStr='slit home')
+                            seq.addSubCmd(actor=enuActor, cmdStr='slit shift=%.5f pixels' % (yn * shift))
+                            seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % (zn * shift))
+
+                    seq.addSubCmd(actor='sps',
+                                  cmdStr='expose arc exptime=%.2f %s' % (exptime, cams),
+                                  timeLim=120 + exptime,
+                                  duplicate=duplicate)
+                    yield from seq
+
+            seq = CmdList()
+            with seq.parallel():
                 for enuActor in enuActors:
                     seq.addSubCmd(actor=enuActor, cmdStr='slit home')
-                    seq.addSubCmd(actor=enuActor, cmdStr='slit shift=%.5f pixels' % (yn * shift))
-                    seq.addSubCmd(actor=enuActor, cmdStr='slit dither=%.5f pixels' % (zn * shift))
-
-                seq.addSubCmd(actor='sps',
-                              cmdStr='expose arc exptime=%.2f %s' % (exptime, cams),
-                              timeLim=120 + exptime,
-                              duplicate=duplicate)
+            yield from seq
 
-        for enuActor in enuActors:
-            seq.addSubCmd(actor=enuActor, cmdStr='slit home')
-
-        return seq
+        length = (end - start) ** 2 * (3 * len(enuActors) + duplicate) + len(enuActors)
+        return LazyCmdList(generator, length=length)
 
     def start(self, cmd=None):
         QThread.start(self)
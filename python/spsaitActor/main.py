@@ -2,11 +2,20 @@
 
 import argparse
 import logging
+import os
+import threading
 import time
+from collections import OrderedDict
 
 import actorcore.ICC
 from spsaitActor.utils import cleanStr
 from spsaitActor.utils.experiment import Experiment
+from spsaitActor.utils.journal import Journal
+from spsaitActor.utils.logbook import Logbook
+from spsaitActor.utils.motion import MotionOptimizer
+from spsaitActor.utils.planning import Plan, Planner
+from spsaitActor.utils.queuing import ExperimentQueue
+from spsaitActor.utils.resources import ResourceManager
 
 
 class SpsaitActor(actorcore.ICC.ICC):
@@ -21,43 +30,231 @@ class SpsaitActor(actorcore.ICC.ICC):
 
         self.specIds = [self.specToAlign]
         self.enus = ['enu_sm%i' % specId for specId in self.specIds]
-        self.addModels(self.enus)
+        self.addModels(self.enus + ['dcb'] + ['ccd_%s' % cam for cam in self.cams])
 
         self.everConnected = False
-        self.current = None
+        self.experiments = OrderedDict()
+        self.stopCondition = threading.Condition()
+        self.resources = ResourceManager(self.stopCondition)
+        self.planner = Planner()
         self.doStop = False
+        self.queue = ExperimentQueue(os.path.join(os.path.expandvars(self.config.get('spsait', 'datadir')),
+                                                  'queue.json'))
 
         self.logger.setLevel(logLevel)
+        Logbook.journalMode = self.logbookJournalMode
+
+        for dbname, experimentId in Journal.recover(Journal.rootdir(self)):
+            self.logger.warning('%s experimentId=%d recovered from journal', dbname, experimentId)
+
+    @property
+    def doStop(self):
+        return self._doStop
+
+    @doStop.setter
+    def doStop(self, doStop):
+        with self.stopCondition:
+            self._doStop = doStop
+            self.stopCondition.notify_all()
 
     @property
     def specToAlign(self):
         return self.config.getint('spsait', 'specToAlign')
 
-    def processSequence(self, cmd, sequence, seqtype, name, comments, head=None, tail=None):
+    @property
+    def cams(self):
+        return [cam.strip() for cam in self.config.get('spsait', 'cams').split(',')]
+
+    @property
+    def pipelining(self):
+        """Start the next moves as soon as the shutters close, instead of waiting for the readout to end."""
+        return self.config.getboolean('spsait', 'pipelining', fallback=False)
+
+    @property
+    def statusWindow(self):
+        """Seconds during which subCommand and status updates are coalesced, 0 publishes each of them at once."""
+        return self.config.getfloat('spsait', 'statusWindow', fallback=0)
+
+    @property
+    def logbookJournalMode(self):
+        """sqlite journal mode of the logbook, WAL only if every reader of the db runs on this host."""
+        return self.config.get('spsait', 'logbookJournalMode', fallback='DELETE').strip().upper()
+
+    @property
+    def motionOptimizer(self):
+        """Optimizer applied to the moves of every new sequence, None if optimizeMoves is off."""
+        if not self.config.getboolean('spsait', 'optimizeMoves', fallback=False):
+            return None
+
+        return MotionOptimizer(homeEvery=self.config.getint('spsait', 'slitHomeEvery', fallback=10))
+
+    def processSequence(self, cmd, sequence, seqtype, name, comments, head=None, tail=None, rawCmd=None):
+        """Process the sequence, or only report and cache it as a plan if the command was issued with plan."""
         head = [] if head is None else head
         tail = [] if tail is None else tail
+        optimizer = self.motionOptimizer
+
+        # a plan sequence was already optimized when the plan was made.
+        if rawCmd is None and optimizer is not None:
+            sequence, movesBefore, movesAfter, saved = optimizer.optimize(sequence)
+            cmd.inform('text="motion optimizer sent %d moves instead of %d, %.1f seconds saved"' % (movesAfter,
+                                                                                                  movesBefore,
+                                                                                                  saved))
+
+        if rawCmd is None and 'plan' in cmd.cmd.keywords:
+            plan = self.planner.add(Plan(cleanStr(cmd.rawCmd), sequence=sequence, seqtype=seqtype, name=name,
+                                         comments=comments, head=head, tail=tail))
+            plan.inform(cmd=cmd)
+            return
+
+        rawCmd = cleanStr(cmd.rawCmd) if rawCmd is None else rawCmd
+        experiment = Experiment(self, rawCmd=rawCmd, sequence=sequence, seqtype=seqtype,
+                                name=name, comments=comments, head=head, tail=tail)
+
+        self.processExperiment(cmd, experiment)
+
+    def rebuildSequence(self, recipe):
+        """Build again a lazy sequence from its journaled recipe, optimized again if it was."""
+        sequence = getattr(self.controllers[recipe['controller']], recipe['method'])(**recipe['kwargs'])
+        if 'homeEvery' not in recipe:
+            return sequence
+
+        return MotionOptimizer(homeEvery=recipe['homeEvery']).lazy(sequence, length=recipe['length'])
+
+    def runPlan(self, cmd, planId):
+        plan = self.planner.pop(planId)
+        self.processSequence(cmd, plan.sequence, seqtype=plan.seqtype, name=plan.name, comments=plan.comments,
+                             head=plan.head, tail=plan.tail, rawCmd=plan.rawCmd)
+
+    def resumeExperiment(self, cmd, experimentId, dbname=None):
+        state = Journal.load(Journal.find(Journal.rootdir(self), experimentId=experimentId, dbname=dbname))
+        if 'experimentId' not in state:
+            raise RuntimeError('experimentId=%d never started, there is nothing to resume' % experimentId)
+        if state['stored'] and not state['cmdError']:
+            raise RuntimeError('%s experimentId=%d was completed, there is nothing to resume' % (state['dbname'],
+                                                                                                 experimentId))
+        if (state['dbname'], state['experimentId']) in self.experiments:
+            raise RuntimeError('%s experimentId=%d is already running' % (state['dbname'], state['experimentId']))
+
+        self.processExperiment(cmd, Experiment.fromJournal(self, state))
 
-        self.current = Experiment(self, rawCmd=cleanStr(cmd.rawCmd), sequence=sequence, seqtype=seqtype,
-                                  name=cleanStr(name), comments=cleanStr(comments), head=head, tail=tail)
+    def processExperiment(self, cmd, experiment):
+        """Wait for the experiment resources, experiments using disjoint resources are processed concurrently."""
+        key = (experiment.dbname, experiment.id)
+        self.experiments[key] = experiment
 
-        self.current.inform(cmd=cmd)
-        self.current.registerCmds(cmd=cmd)
-        self.current.process(cmd=cmd)
-        self.current = None
+        try:
+            experiment.inform(cmd=cmd)
+
+            for resource, owner in sorted(self.resources.busy(experiment.resources).items()):
+                cmd.inform('text="waiting for %s experimentId=%d to release %s"' % (owner.dbname, owner.id, resource))
+
+            if not self.resources.acquire(experiment, experiment.resources, isStopped=experiment.isStopped):
+                experiment.store()
+                raise RuntimeError('abort sequence requested..')
+
+            try:
+                experiment.registerCmds(cmd=cmd)
+                experiment.process(cmd=cmd)
+            finally:
+                self.resources.release(experiment)
+        finally:
+            self.experiments.pop(key, None)
+
+    def abort(self, experimentId=None, dbname=None):
+        """Abort experimentId, or every experiment if None, return the aborted experiments."""
+        if experimentId is None:
+            self.doStop = True
+
+        experiments = [experiment for experiment in list(self.experiments.values()) if
+                       experimentId in [None, experiment.id] and dbname in [None, experiment.dbname]]
+
+        for experiment in experiments:
+            experiment.abort()
+
+        return experiments
 
     def getStatus(self, cmd):
-        if self.current is None:
-            return
-        self.current.inform(cmd=cmd)
-        self.current.status(cmd=cmd)
+        for experiment in list(self.experiments.values()):
+            experiment.inform(cmd=cmd)
+            experiment.publisher.publishState(cmd=cmd)
+
+    def stopped(self, isStopped=None):
+        return (lambda: self._doStop) if isStopped is None else isStopped
+
+    def waitUntil(self, end, isStopped=None):
+        """Block until end or until an abort is requested, whichever comes first."""
+        isStopped = self.stopped(isStopped)
+
+        with self.stopCondition:
+            self.stopCondition.wait_for(isStopped, timeout=max(end - time.time(), 0))
+
+            return isStopped()
+
+    def waitSettled(self, condition, end, isStopped=None):
+        """Block until the settle condition is met, end is reached or an abort is requested."""
+        isStopped = self.stopped(isStopped)
+
+        def wakeUp(*args, **kwargs):
+            with self.stopCondition:
+                self.stopCondition.notify_all()
+
+        for keyVar in condition.keyVars:
+            keyVar.addCallback(wakeUp, callNow=False)
+
+        try:
+            with self.stopCondition:
+                self.stopCondition.wait_for(lambda: isStopped() or condition.isReady(),
+                                            timeout=max(end - time.time(), 0))
+
+                return isStopped()
+        finally:
+            for keyVar in condition.keyVars:
+                keyVar.removeCallback(wakeUp)
+
+    def interruptibleCall(self, isStopped=None, lateCalls=None, onLate=None, **kwargs):
+        """Run cmdr.call in a helper thread, return None as soon as an abort is requested.
+
+        The command itself keeps running, the helper thread is then added to lateCalls and onLate is called with the
+        cmdVar once it returns. An exception raised by cmdr.call is raised again in the calling thread.
+        """
+        isStopped = self.stopped(isStopped)
+        cmdVars = []
+        errors = []
+        abandoned = []
+
+        def call():
+            try:
+                cmdVar = self.cmdr.call(**kwargs)
+            except Exception as e:
+                with self.stopCondition:
+                    errors.append(e)
+                    self.stopCondition.notify_all()
+                return
+
+            with self.stopCondition:
+                cmdVars.append(cmdVar)
+                self.stopCondition.notify_all()
+                isLate = bool(abandoned)
+
+            if isLate and onLate is not None:
+                onLate(cmdVar)
+
+        with self.stopCondition:
+            if not isStopped():
+                thread = threading.Thread(target=call, daemon=True)
+                thread.start()
+                self.stopCondition.wait_for(lambda: cmdVars or errors or isStopped())
+
+                if errors:
+                    raise errors[0]
 
-    def waitUntil(self, end, ti=0.01):
-        while time.time() < end:
-            if self.doStop:
-                break
-            time.sleep(ti)
+                if not cmdVars:
+                    abandoned.append(thread)
+                    if lateCalls is not None:
+                        lateCalls.append(thread)
 
-        return self.doStop
+        return cmdVars[0] if cmdVars else None
 
     def resetSequence(self):
         self.doStop = False
@@ -85,7 +282,10 @@ def main():
                            productName='spsaitActor',
                            configFile=args.config,
                            logLevel=args.logLevel)
-    theActor.run()
+    try:
+        theActor.run()
+    finally:
+        Logbook.close()
 
 
 if __name__ == '__main__':
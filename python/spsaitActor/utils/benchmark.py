@@ -0,0 +1,127 @@
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+from spsaitActor.utils.simulator import SimActor, SimCmdr
+
+# name: (controller, method, kwargs(size), sizes), the sequence length grows with size.
+cases = OrderedDict([
+    ('calib.biases', ('calib', 'biases', lambda n: dict(duplicate=n, cams=False), [10, 100, 1000])),
+    ('calib.darks', ('calib', 'darks', lambda n: dict(duplicate=n, exptime=300, cams=False), [10, 100, 1000])),
+    ('calib.imstab', ('calib', 'imstab', lambda n: dict(exptime=2, duration=n, delay=0.25, duplicate=3, cams=False,
+                                                        keepOn=False, switchOn=['neon', 'hgar'], attenuator='',
+                                                        force=''), [6, 48, 168])),
+    ('expose.arcs', ('expose', 'arcs', lambda n: dict(exptype='arc', exptime=2, duplicate=n, cams=['b1', 'r1']),
+                     [10, 100, 1000])),
+    ('dither.ditherflat', ('dither', 'ditherflat', lambda n: dict(exptime=2, cams=False, shift=0.01, nbPosition=n,
+                                                                  duplicate=1), [5, 50, 500])),
+    ('dither.ditherpsf', ('dither', 'ditherpsf', lambda n: dict(exptime=2, cams=False, shift=1. / n, doMinus=True,
+                                                                duplicate=1), [2, 10, 30])),
+    ('align.slitTF', ('align', 'slitTF', lambda n: dict(exptime=2, positions=np.linspace(-1, 1, n), cams=False,
+                                                        duplicate=1), [11, 101, 1001])),
+    ('align.detalign', ('align', 'detalign', lambda n: dict(exptime=2, cam='b1', lowBound=0, upBound=300,
+                                                            nbPosition=n, tilt=np.zeros(3), duplicate=1,
+                                                            waveRange=(500, 1000, 10)), [5, 50, 200])),
+    ('sac.sacalign', ('sac', 'sacalign', lambda n: dict(exptime=2, positions=np.linspace(-10, 10, n), focus=0,
+                                                        duplicate=1), [10, 100, 1000])),
+    ('defocus.defocus', ('defocus', 'defocus', lambda n: dict(exptime=2, positions=np.linspace(-4, 4, n),
+                                                              attenuator=120, cams=False, duplicate=1),
+                         [9, 49, 199])),
+])
+
+
+def measure(actor, ctrlName, method, kwargs, repeat=5):
+    """Return the number of subCmds, the best build time over repeat and the tracemalloc peak of one build.
+
+    The sequence is iterated once as part of the build, so the subCmds of a lazy sequence are built too.
+    """
+    build = getattr(actor.controller(ctrlName), method)
+    seconds = []
+
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        sequence = build(**kwargs)
+        nSubCmds = sum(1 for subCmd in sequence)
+        seconds.append(time.perf_counter() - start)
+        del sequence
+
+    gc.collect()
+    tracemalloc.start()
+    sequence = build(**kwargs)
+    sum(1 for subCmd in sequence)
+    __, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sequence
+
+    return nSubCmds, min(seconds), peak
+
+
+def run(names=None, repeat=5, specIds=(1, 2)):
+    actor = SimActor(SimCmdr(), specIds=specIds)
+    results = OrderedDict()
+
+    for name in (cases.keys() if names is None else names):
+        ctrlName, method, kwargs, sizes = cases[name]
+        for size in sizes:
+            try:
+                nSubCmds, seconds, peak = measure(actor, ctrlName, method, kwargs(size), repeat=repeat)
+            except ImportError as e:
+                print('%s skipped : %s' % (name, e))
+                break
+
+            results['%s[%d]' % (name, size)] = dict(nSubCmds=nSubCmds, seconds=seconds, peakKiB=peak / 1024,
+                                                    usPerSubCmd=1e6 * seconds / max(nSubCmds, 1))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the cases whose build time or memory peak grew by more than tolerance since the baseline."""
+    regressions = []
+    for key, res in results.items():
+        if key not in baseline:
+            continue
+        for metric in ['seconds', 'peakKiB']:
+            if res[metric] > baseline[key][metric] * (1 + tolerance):
+                regressions.append((key, metric, baseline[key][metric], res[metric]))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cases', nargs='*', default=None, help='cases to run, all by default')
+    parser.add_argument('--repeat', default=5, type=int, help='builds per measurement, the best time is kept')
+    parser.add_argument('--save', default=None, type=str, help='write the results as a baseline json file')
+    parser.add_argument('--baseline', default=None, type=str, help='baseline json file to compare with')
+    parser.add_argument('--tolerance', default=0.25, type=float, help='allowed relative growth before failing')
+    args = parser.parse_args()
+
+    results = run(names=args.cases if args.cases else None, repeat=args.repeat)
+
+    print('%-28s %8s %12s %14s %12s' % ('case', 'subCmds', 'build(ms)', 'us/subCmd', 'peak(KiB)'))
+    for key, res in results.items():
+        print('%-28s %8d %12.3f %14.2f %12.1f' % (key, res['nSubCmds'], 1000 * res['seconds'], res['usPerSubCmd'],
+                                                  res['peakKiB']))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+
+        for key, metric, before, after in regressions:
+            print('REGRESSION %s %s : %.4g -> %.4g' % (key, metric, before, after))
+
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
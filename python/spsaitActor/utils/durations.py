@@ -0,0 +1,137 @@
+import re
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from datetime import datetime as dt
+
+import numpy as np
+from spsaitActor.utils.logbook import Logbook
+
+
+class DurationModel(object):
+    """Duration of subCmd calls per (actor family, verb, exptime), learned from the SubCmdTiming logbook table."""
+    maxSamples = 500
+    # p99 based timeLim is only trusted with enough samples, the timeLim given in the sequence is used otherwise.
+    minSamples = 20
+    margin = 1.5
+    slack = 30
+    # overhead assumed for a verb which was never timed.
+    overhead = 10
+
+    def __init__(self):
+        object.__init__(self)
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.samples = defaultdict(lambda: deque(maxlen=DurationModel.maxSamples))
+        # estimates per (actor family, verb) then exptime, and overhead per (actor family, verb), dropped by record.
+        self.estimates = defaultdict(dict)
+        self.overheads = dict()
+
+    @staticmethod
+    def key(actor, cmdStr):
+        """Return (actor family, verb, exptime), ie ('enu_sm', 'slit dither', 0.0) or ('sps', 'expose arc', 2.0).
+
+        The verb keeps the argument name, arc on=... and arc off=... are timed separately.
+        """
+        family = re.sub(r'\d+$', '', actor)
+        words = []
+        for word in cmdStr.split()[:2]:
+            word = word.split('=')[0]
+            if not word.isalpha():
+                break
+            words.append(word)
+
+        exptime = re.search(r'exptime=([\d.]+)', cmdStr)
+        exptime = round(float(exptime.group(1)), 2) if exptime else 0.
+
+        return family, ' '.join(words), exptime
+
+    def load(self):
+        samples = defaultdict(lambda: deque(maxlen=DurationModel.maxSamples))
+        try:
+            rows = [row for page in Logbook.querySubCmdTimings(limit=100 * self.maxSamples) for row in page]
+        except sqlite3.Error:
+            rows = []
+
+        for actor, verb, exptime, duration in reversed(rows):
+            samples[(actor, verb, exptime)].append(duration)
+
+        with self.lock:
+            self.samples = samples
+            self.estimates = defaultdict(dict)
+            self.overheads = dict()
+            self.loaded = True
+
+    def get(self, key):
+        if not self.loaded:
+            self.load()
+
+        with self.lock:
+            return list(self.samples.get(key, []))
+
+    def record(self, subCmd, duration):
+        """Add the duration of a successful call, in memory and in the logbook."""
+        actor, verb, exptime = key = self.key(subCmd.actor, subCmd.cmdStr)
+        if not self.loaded:
+            self.load()
+
+        with self.lock:
+            self.samples[key].append(duration)
+            self.estimates.pop((actor, verb), None)
+            self.overheads.pop((actor, verb), None)
+
+        Logbook.newSubCmdTiming(actor=actor, verb=verb, exptime=exptime, duration=duration,
+                                date=dt.utcnow().replace(microsecond=0).isoformat())
+
+    def estimate(self, subCmd):
+        """Median duration of the same call, or of the same verb corrected by the exptime, or a plain guess."""
+        actor, verb, exptime = key = self.key(subCmd.actor, subCmd.cmdStr)
+        if not self.loaded:
+            self.load()
+
+        with self.lock:
+            estimates = self.estimates[(actor, verb)]
+            if exptime not in estimates:
+                samples = self.samples.get(key)
+                estimates[exptime] = float(np.median(samples)) if samples else exptime + self.overheadOf(actor, verb)
+
+            return estimates[exptime]
+
+    def overheadOf(self, actor, verb):
+        """Median duration minus exptime over every sample of the verb, called with the lock held."""
+        if (actor, verb) not in self.overheads:
+            overheads = [duration - otherExptime for (otherActor, otherVerb, otherExptime), durations in
+                         self.samples.items() if (otherActor, otherVerb) == (actor, verb) for duration in durations]
+            self.overheads[(actor, verb)] = float(np.median(overheads)) if overheads else self.overhead
+
+        return self.overheads[(actor, verb)]
+
+    def total(self, steps, estimates=None):
+        """Estimated duration of steps, a parallel group lasts as long as its longest lane.
+
+        estimates memoizes the estimate per (actor, cmdStr), it can be shared by successive calls.
+        """
+        total = 0
+        estimates = dict() if estimates is None else estimates
+
+        for step in steps:
+            lanes = defaultdict(float)
+            for subCmd in step:
+                key = (subCmd.actor, subCmd.cmdStr)
+                if key not in estimates:
+                    estimates[key] = self.estimate(subCmd)
+                lanes[subCmd.lane] += estimates[key] + (subCmd.tempo if subCmd.tempo else 0)
+            total += max(lanes.values()) if lanes else 0
+
+        return total
+
+    def timeLim(self, subCmd):
+        """p99 based timeLim once there are enough samples, subCmd.timeLim otherwise."""
+        samples = self.get(self.key(subCmd.actor, subCmd.cmdStr))
+        if len(samples) < self.minSamples:
+            return subCmd.timeLim
+
+        return int(np.percentile(samples, 99) * self.margin + self.slack)
+
+
+durationModel = DurationModel()
@@ -1,118 +1,500 @@
+import itertools
+import threading
 import time
+from array import array
+from collections import OrderedDict, deque
 from datetime import datetime as dt
 
-import numpy as np
 from spsaitActor.utils import cleanStr
+import spsaitActor.utils.pipeline as pipeline
+import spsaitActor.utils.settle as settle
 import spsaitActor.utils.storage as storage
+from spsaitActor.utils.durations import durationModel
+from spsaitActor.utils.journal import Journal
 from spsaitActor.utils.logbook import Logbook
+from spsaitActor.utils.lookup import visitIndex
+from spsaitActor.utils.publishing import StatusPublisher
+from spsaitActor.utils.sequencing import CmdList, LazyCmdList, SubCmd
+from spsaitActor.utils.slit import isSlitMove, replayFrom
 
 
 class Experiment(object):
     stopMsg = ["""text="command failed: UserWarning('Stop requested') in waitUntil()"""]
+    # number of subCommand keywords informed ahead of the subCmd being processed.
+    registerWindow = 50
 
-    def __init__(self, actor, rawCmd, sequence, seqtype, name, comments, head, tail):
+    def __init__(self, actor, rawCmd, sequence, seqtype, name, comments, head, tail, dbname=None, experimentId=None,
+                 startdate=None):
         object.__init__(self)
         self.actor = actor
-        self.cmdStr = 'spsait %s' % (rawCmd.replace("name='%s'" % name, '').replace("comments='%s'" % comments, ''))
+        self.cmdStr = 'spsait %s' % (rawCmd.replace("name='%s'" % cleanStr(name), '')
+                                     .replace("comments='%s'" % cleanStr(comments), ''))
         self.sequence = sequence
         self.seqtype = seqtype
         self.name = name
         self.comments = comments
         self.head = head
         self.tail = tail
+        self.nSubCmds = len(head) + len(sequence) + len(tail)
+        self.nSteps = len(head) + len(sequence)
+        self.liveSubCmds = None
+        self.window = deque()
+        self.nRegistered = 0
+        self.nPulled = 0
+        self.stepId = 0
+        self.lastGroup = None
 
         self.cmdError = ''
+        self.settleSaved = 0
+        self.pending = None
+        # helper threads of aborted calls which have not returned yet.
+        self.lateCalls = []
+        self.doStop = False
+        self.lock = threading.Lock()
+        self.publisher = StatusPublisher(self, window=actor.statusWindow)
         self.dateobs = dt.utcnow().replace(microsecond=0)
+        self.startdate = self.dateobs.isoformat() if startdate is None else startdate
 
-        self.dbname = self.getStorage()
-        self.id = Logbook.lastExperimentId(dbname=self.dbname) + 1
+        self.dbname = self.getStorage() if dbname is None else dbname
+        resumed = experimentId is not None
+        if experimentId is None:
+            experimentId = Logbook.reserveExperimentId(dbname=self.dbname,
+                                                       name=self.name,
+                                                       seqtype=self.seqtype,
+                                                       cmdStr=self.cmdStr,
+                                                       comments=self.comments,
+                                                       startdate=self.startdate)
+        self.id = experimentId
+        try:
+            self.journal = Journal(Journal.rootdir(actor), dbname=self.dbname, experimentId=self.id, append=resumed)
+        except RuntimeError:
+            Logbook.releaseExperimentId(dbname=self.dbname, experimentId=self.id)
+            raise
 
-    @property
-    def subCmds(self):
-        return self.head + self.sequence + self.tail
+        try:
+            self.initCounters()
+        except Exception:
+            if not resumed:
+                Logbook.releaseExperimentId(dbname=self.dbname, experimentId=self.id)
+                self.journal.stored()
+            raise
 
-    @property
-    def visits(self):
-        return [subCmd.visit for subCmd in self.subCmds if subCmd.visit != -1]
+    @classmethod
+    def fromJournal(cls, actor, state):
+        """Rebuild an experiment from its journal, sequence subCmds which already succeeded keep their state.
+
+        A lazy sequence journaled as a recipe is built again by its controller. Slit moves are sent again from the
+        last home or absolute move preceding the resume point, see slit.replayFrom.
+        """
+        head, tail = [CmdList.fromDescriptions(state[key]) for key in ['head', 'tail']]
+        if state.get('recipe') is None:
+            journaled = CmdList.fromDescriptions(state['sequence'])
+        else:
+            journaled = actor.rebuildSequence(state['recipe'])
+
+        done = set([cmdId for cmdId, finished in state['finished'].items() if finished['didFail'] == 0])
+        anchors = replayFrom(journaled, first=len(head), done=done)
+
+        def restored(subCmds):
+            for cmdId, subCmd in enumerate(subCmds, start=len(head)):
+                if cmdId in done and not (isSlitMove(subCmd) and cmdId >= anchors.get(subCmd.actor, cmdId + 1)):
+                    finished = state['finished'][cmdId]
+                    subCmd.restore(didFail=0, visit=finished['visit'], cleanReply=finished['reply'])
+                yield subCmd
+
+        if state.get('recipe') is None:
+            sequence = CmdList()
+            sequence.extend(restored(journaled))
+        else:
+            sequence = LazyCmdList(lambda: restored(journaled), length=len(journaled), recipe=journaled.recipe)
+
+        return cls(actor, rawCmd=state['cmdStr'].replace('spsait ', '', 1), sequence=sequence,
+                   seqtype=state['seqtype'], name=state['name'], comments=state['comments'], head=head, tail=tail,
+                   dbname=state['dbname'], experimentId=state['experimentId'], startdate=state['startdate'])
 
     @property
     def completion(self):
-        completed = [subCmd for subCmd in self.subCmds if subCmd.didFail != -1]
-        return 100 * len(completed) / len(self.subCmds)
+        return 100 * self.nCompleted / self.nSubCmds if self.nSubCmds else 100
 
     @property
     def remainingTime(self):
-        completed = [subCmd for subCmd in self.subCmds if subCmd.didFail != -1]
-        if not completed:
-            return np.nan
-        speed = len(completed) / ((dt.utcnow() - self.dateobs).total_seconds())
-        return (len(self.subCmds) - len(completed)) / speed
+        return self.remaining
+
+    def preview(self):
+        """Iterate over every subCmd, a lazy sequence builds new subCmds which are not kept."""
+        return itertools.chain(self.head, self.sequence, self.tail)
+
+    def initCounters(self):
+        """Count completed subCmds, visit range, resources and remaining time in a single preview pass.
+
+        The experiment is journaled in the same pass, a sequence without recipe is described chunk by chunk.
+        transition() keeps the counters up to date, steps are numbered the same way by nextSubCmd().
+        """
+        self.nCompleted = 0
+        self.visitStart = self.visitEnd = -1
+        self.pendingPerStep = array('i')
+        self.stepEstimates = array('d')
+        resources = set()
+        estimates = dict()
+
+        recipe = getattr(self.sequence, 'recipe', None)
+        self.journal.experiment(self, recipe=recipe)
+        # positions of the sequence subCmds in the preview, they are only described if there is no recipe.
+        first, end = len(self.head), len(self.head) if recipe is not None else self.nSteps
+        position = 0
+        chunk = []
+
+        for step in self.steps(self.preview()):
+            pending = [subCmd for subCmd in step if subCmd.didFail == -1]
+            self.pendingPerStep.append(len(pending))
+            self.stepEstimates.append(durationModel.total([pending], estimates=estimates))
+
+            for subCmd in step:
+                resources.update(subCmd.resources)
+                self.nCompleted += int(subCmd.didFail != -1)
+                self.updateVisits(subCmd.visit)
+
+                if first <= position < end:
+                    chunk.append(subCmd.describe())
+                    if len(chunk) == self.journal.chunkSize:
+                        self.journal.sequence(chunk)
+                        chunk = []
+                position += 1
+
+        if chunk:
+            self.journal.sequence(chunk)
+
+        self.resources = sorted(resources)
+        self.remaining = sum(self.stepEstimates)
+
+    def updateVisits(self, visit):
+        if visit == -1:
+            return
+
+        self.visitStart = visit if self.visitStart == -1 else min(self.visitStart, visit)
+        self.visitEnd = max(self.visitEnd, visit)
+
+    def transition(self, subCmd, wasCompleted):
+        """Called by subCmd.update, O(1) whatever the length of the sequence."""
+        with self.lock:
+            if not wasCompleted and subCmd.didFail != -1:
+                self.nCompleted += 1
+                self.pendingPerStep[subCmd.stepId] -= 1
+                if not self.pendingPerStep[subCmd.stepId]:
+                    self.remaining -= self.stepEstimates[subCmd.stepId]
+
+            self.updateVisits(subCmd.visit)
 
     def inform(self, cmd):
         cmd.inform('experiment=%s,%d,%s,"%s","%s","%s"' % (self.dbname, self.id, self.seqtype, self.cmdStr,
-                                                           self.name, self.comments))
+                                                           cleanStr(self.name), cleanStr(self.comments)))
 
     def status(self, cmd):
         cmd.inform('status=%.2f,%d' % (self.completion, self.remainingTime))
+        cmd.inform('experimentStatus=%d,%.2f,%d' % (self.id, self.completion, self.remainingTime))
+
+    def isStopped(self):
+        """Aborted on its own, or by an abort of every experiment sent before it was even known to the actor."""
+        return self.doStop or self.actor.doStop
+
+    def abort(self):
+        """Stop this experiment only, waiting calls of the other experiments are woken up but keep going."""
+        with self.actor.stopCondition:
+            self.doStop = True
+            self.actor.stopCondition.notify_all()
 
     def registerCmds(self, cmd):
-        for cmdId, subCmd in enumerate(self.subCmds):
-            subCmd.setId(self, cmdId=cmdId)
-            subCmd.inform(cmd=cmd)
+        """Only inform the first subCmds, pull() informs the next ones."""
+        self.liveSubCmds = self.preview()
+        self.register(cmd, upTo=min(self.registerWindow, self.nSubCmds))
+
+    def nextSubCmd(self):
+        """Build the next live subCmd and give it its id and stepId."""
+        subCmd = next(self.liveSubCmds)
+        if self.nRegistered and (subCmd.group is None or subCmd.group != self.lastGroup):
+            self.stepId += 1
+
+        subCmd.setId(self, cmdId=self.nRegistered)
+        subCmd.stepId = self.stepId
+        self.lastGroup = subCmd.group
+        self.nRegistered += 1
+
+        return subCmd
+
+    def register(self, cmd, upTo):
+        while self.nRegistered < upTo:
+            subCmd = self.nextSubCmd()
+            self.publisher.register(cmd, subCmd=subCmd)
+            self.window.append(subCmd)
+
+    def pull(self, cmd, end):
+        """Yield the subCmds up to end, keeping registerWindow subCmds registered ahead of them.
+
+        Finished subCmds are dropped from the window, so memory does not grow with the sequence length.
+        """
+        while self.nPulled < end:
+            while self.window and self.window[0].id < self.nPulled and self.window[0].didFail != -1:
+                self.window.popleft()
+
+            self.register(cmd, upTo=min(self.nPulled + self.registerWindow, self.nSubCmds))
+            subCmd = self.window[self.nPulled - self.window[0].id]
+            self.nPulled += 1
+            yield subCmd
+
+    def skip(self, cmd, end):
+        """Count the subCmds up to end which were never registered as failed, they are published as one range."""
+        first = self.nRegistered
+        while self.nRegistered < end:
+            self.nextSubCmd().update(didFail=1, cleanReply='')
+
+        if first < end:
+            self.publisher.publishRange(cmd, first=first, last=end - 1, didFail=1)
+
+        self.nPulled = max(self.nPulled, end)
+
+    @staticmethod
+    def steps(subCmds):
+        """Yield consecutive subCmds sharing the same parallel group together, others one by one."""
+        step = []
+        for subCmd in subCmds:
+            if step and (subCmd.group is None or subCmd.group != step[-1].group):
+                yield step
+                step = []
+            step.append(subCmd)
+
+        if step:
+            yield step
 
     def process(self, cmd):
         try:
-            for subCmd in (self.head + self.sequence):
-                self.processSubCmd(cmd, subCmd=subCmd)
+            for step in self.steps(self.pull(cmd, end=self.nSteps)):
+                step = [subCmd for subCmd in step if not subCmd.isDone]
+                if not step:
+                    continue
+
+                # only moves may overlap with the readout, any other sps command waits for the pending exposure.
+                if any([subCmd.actor == 'sps' for subCmd in step]):
+                    self.joinExposure(cmd)
+
+                if self.actor.pipelining and len(step) == 1 and pipeline.isExposure(step[0]):
+                    self.startExposure(cmd, subCmd=step[0])
+                elif len(step) > 1:
+                    self.processGroup(cmd, subCmds=step)
+                else:
+                    self.processSubCmd(cmd, subCmd=step[0])
+
+            self.joinExposure(cmd)
 
         finally:
-            for subCmd in self.tail:
+            self.joinExposure(cmd, doRaise=False)
+            self.joinLateCalls(cmd)
+            self.skip(cmd, end=self.nSteps)
+
+            for subCmd in self.pull(cmd, end=self.nSubCmds):
                 self.processSubCmd(cmd, subCmd=subCmd, doRaise=False)
 
+            self.publisher.flush()
             self.store()
+            cmd.inform('text="settle conditions saved %.1f seconds"' % self.settleSaved)
+
+    def startExposure(self, cmd, subCmd):
+        """Run the exposure in the background, return as soon as the shutters are closed or the exposure is done."""
+        condition = self.actor.stopCondition
+        watcher = pipeline.ShutterWatcher(self.actor, subCmd, condition)
+        result = dict()
+
+        def expose():
+            try:
+                result['cmdVar'], result['doStop'] = self.runSubCmd(cmd, subCmd=subCmd)
+            except Exception as e:
+                result['error'] = e
+            finally:
+                with condition:
+                    result['done'] = True
+                    condition.notify_all()
+
+        thread = threading.Thread(target=expose)
+        thread.start()
+
+        try:
+            with condition:
+                condition.wait_for(lambda: 'done' in result or watcher.isClosed)
+        finally:
+            watcher.close()
+
+        self.pending = (subCmd, thread, result)
+
+    def joinExposure(self, cmd, doRaise=True):
+        """Wait for the pending exposure to be read out, then check it as any other subCmd."""
+        if self.pending is None:
+            return
+
+        subCmd, thread, result = self.pending
+        thread.join()
+        self.pending = None
+
+        if not doRaise:
+            return
+
+        if 'error' in result:
+            raise result['error']
+
+        self.checkSubCmd(cmd, subCmd=subCmd, cmdVar=result['cmdVar'], doStop=result['doStop'])
+
+    def joinLateCalls(self, cmd):
+        """Wait for the aborted calls to actually return, their late reply is journaled before anything else is sent."""
+        while self.lateCalls:
+            thread = self.lateCalls.pop(0)
+            if thread.is_alive():
+                cmd.inform('text="waiting for an aborted subCmd to return"')
+            thread.join()
 
     def processSubCmd(self, cmd, subCmd, doRaise=True):
-        cmdVar = subCmd.callAndUpdate(cmd=cmd)
-        self.status(cmd=cmd)
+        cmdVar, doStop = self.runSubCmd(cmd, subCmd=subCmd, doRaise=doRaise)
+        self.checkSubCmd(cmd, subCmd=subCmd, cmdVar=cmdVar, doStop=doStop, doRaise=doRaise)
+
+    def processGroup(self, cmd, subCmds):
+        """Process each lane of a parallel group in its own thread, lanes are joined before the next step."""
+        lanes = OrderedDict()
+        for subCmd in subCmds:
+            lanes.setdefault(subCmd.lane, []).append(subCmd)
+
+        failures = []
+        errors = []
+
+        def processLane(lane):
+            try:
+                for subCmd in lane:
+                    if failures or errors:
+                        return
+                    cmdVar, doStop = self.runSubCmd(cmd, subCmd=subCmd)
+                    if cmdVar is None or cmdVar.didFail or doStop:
+                        failures.append((subCmd, cmdVar, doStop))
+                        return
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=processLane, args=(lane,)) for lane in lanes.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # lanes stopped by the failure of another one, whatever their ids, are never run.
+        if failures or errors:
+            for subCmd in subCmds:
+                if subCmd.didFail == -1:
+                    subCmd.update(didFail=1, cleanReply='')
+                    self.journal.finish(subCmd)
+                    self.publisher.publish(cmd, subCmd=subCmd)
+
+        if errors:
+            raise errors[0]
+
+        for subCmd, cmdVar, doStop in sorted(failures, key=lambda failure: failure[0].id)[:1]:
+            self.checkSubCmd(cmd, subCmd=subCmd, cmdVar=cmdVar, doStop=doStop)
+
+    def runSubCmd(self, cmd, subCmd, doRaise=True):
+        """Call subCmd then settle, return its cmdVar (None if aborted) and doStop."""
+        cmdVar = subCmd.callAndUpdate(cmd=cmd, interruptible=doRaise)
+        cmdVar = self.retrySubCmd(cmd, subCmd=subCmd, cmdVar=cmdVar, doRaise=doRaise)
+        self.publisher.status(cmd=cmd)
+
+        if cmdVar is None or (cmdVar.didFail and doRaise):
+            return cmdVar, False
+
+        return cmdVar, self.settle(subCmd)
+
+    def retrySubCmd(self, cmd, subCmd, cmdVar, doRaise=True):
+        """Call subCmd again as long as its retry policy allows it, each retry is reported in subCommand."""
+        policy = subCmd.retryPolicy
+        isStopped = self.isStopped if doRaise else (lambda: False)
+        attempt = 1
+
+        while cmdVar is not None and cmdVar.didFail and policy.isRetryable(attempt, subCmd.cleanReply):
+            delay = policy.delay(attempt)
+            subCmd.cleanReply = 'attempt %d/%d failed, retrying in %.1fs : %s' % (attempt, policy.maxAttempts,
+                                                                                  delay, subCmd.cleanReply)
+            self.publisher.publish(cmd, subCmd=subCmd, full=True)
+
+            if self.actor.waitUntil(time.time() + delay, isStopped=isStopped):
+                break
+
+            attempt += 1
+            cmdVar = subCmd.callAndUpdate(cmd=cmd, interruptible=doRaise)
+
+        return cmdVar
+
+    def checkSubCmd(self, cmd, subCmd, cmdVar, doStop, doRaise=True):
+        if cmdVar is None:
+            self.handleError(cmd=cmd, cmdId=subCmd.id)
+            raise RuntimeError('abort sequence requested..')
 
         if cmdVar.didFail and doRaise:
             self.handleError(cmd=cmd, cmdId=subCmd.id, cmdVar=cmdVar)
             raise RuntimeError('subCmd has failed.. sequence aborted..')
 
-        doStop = self.actor.waitUntil(time.time() + subCmd.tempo)
         if doStop and doRaise:
             self.handleError(cmd=cmd, cmdId=subCmd.id)
             raise RuntimeError('abort sequence requested..')
 
+    def settle(self, subCmd):
+        """Wait for the explicit tempo, or for the hardware to be ready with defaultTempo as a timeout."""
+        if subCmd.tempo is not None:
+            return self.actor.waitUntil(time.time() + subCmd.tempo, isStopped=self.isStopped)
+
+        condition = settle.condition(subCmd, self.actor.models)
+        if condition is None:
+            return self.actor.waitUntil(time.time() + SubCmd.defaultTempo, isStopped=self.isStopped)
+
+        start = time.time()
+        doStop = self.actor.waitSettled(condition, start + SubCmd.defaultTempo, isStopped=self.isStopped)
+        self.settleSaved += max(SubCmd.defaultTempo - (time.time() - start), 0)
+
+        return doStop
+
     def handleError(self, cmd, cmdId, cmdVar=None):
-        for id in range(cmdId + 1, len(self.head + self.sequence)):
-            self.subCmds[id].didFail = 1
-            self.subCmds[id].inform(cmd)
+        # subCmds which are not registered yet are published as a single range by skip().
+        for subCmd in list(self.window):
+            if not cmdId < subCmd.id < self.nSteps or subCmd.didFail != -1:
+                continue
+            subCmd.update(didFail=1, cleanReply=subCmd.cleanReply)
+            self.publisher.publish(cmd, subCmd=subCmd)
 
         cmdErrors = self.stopMsg if cmdVar is None else [r.keywords.canonical(delimiter=';') for r in cmdVar.replyList]
         self.cmdError = cmdErrors[-1]
+        self.journal.error(self.cmdError)
 
         for cmdError in cmdErrors:
             cmd.warn(cmdError)
 
     def store(self):
-        if self.visits:
+        if self.visitStart != -1:
             Logbook.newExperiment(dbname=self.dbname,
                                   experimentId=self.id,
-                                  visitStart=min(self.visits),
-                                  visitEnd=max(self.visits),
+                                  visitStart=self.visitStart,
+                                  visitEnd=self.visitEnd,
                                   seqtype=self.seqtype,
                                   cmdStr=self.cmdStr,
                                   name=self.name,
                                   comments=self.comments,
-                                  startdate=self.dateobs.isoformat(),
+                                  startdate=self.startdate,
                                   cmdError=self.cmdError
                                   )
+            visitIndex.insert(dbname=self.dbname,
+                              experimentId=self.id,
+                              visitStart=self.visitStart,
+                              visitEnd=self.visitEnd)
+        else:
+            Logbook.releaseExperimentId(dbname=self.dbname, experimentId=self.id)
+
+        Logbook.flush()
+        self.journal.stored()
 
     def getStorage(self):
         try:
             location = storage.locate(seqtype=self.seqtype)
         except KeyError:
-            location = storage.guess(subCmds=self.subCmds)
+            location = storage.guess(subCmds=self.preview())
 
         return location
\ No newline at end of file
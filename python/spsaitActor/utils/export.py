@@ -0,0 +1,172 @@
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+from spsaitActor.utils.logbook import Logbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+extensions = dict(parquet='parquet', arrow='arrow', npz='npz')
+
+# Exposure and CamExposure are append-only, Experiment rows are finalized in place so it is rewritten each time.
+appendOnly = ['Exposure', 'CamExposure']
+rewritten = ['Experiment']
+
+
+def export(dbname, outdir, fmt='parquet', chunkSize=10000, incremental=True):
+    """Stream logbook tables to columnar files in outdir/dbname/table/part-NNNNNN.ext, chunkSize rows at a time.
+
+    With incremental, only the Exposure/CamExposure rows added since the last export are written to a new part.
+    Parquet and Arrow IPC need pyarrow, npz is used as a fallback and writes one part per chunk.
+
+    :returns: {table: number of exported rows}
+    """
+    fmt = 'npz' if pa is None else fmt
+    stateFile = os.path.join(outdir, dbname, 'export.json')
+    state = loadState(stateFile) if incremental else dict()
+    exported = dict()
+
+    for table in appendOnly + rewritten:
+        try:
+            columnTypes = Logbook.columnTypes(dbname, table)
+        except ValueError:
+            continue
+
+        tabledir = os.path.join(outdir, dbname, table)
+        os.makedirs(tabledir, exist_ok=True)
+
+        if not incremental or table in rewritten:
+            for filepath in glob.glob(os.path.join(tabledir, 'part-*')):
+                os.remove(filepath)
+
+        if table in appendOnly:
+            sqlRequest = """SELECT rowid, * FROM %s WHERE rowid > ? ORDER BY rowid""" % table
+            pages = Logbook.query(dbname, sqlRequest, params=(state.get(table, 0),), pageSize=chunkSize)
+        else:
+            sqlRequest = """SELECT rowid, * FROM %s WHERE visitStart != -1 ORDER BY rowid""" % table
+            pages = Logbook.query(dbname, sqlRequest, pageSize=chunkSize)
+
+        part = len(glob.glob(os.path.join(tabledir, 'part-*')))
+
+        nRows, lastRowId = writeParts(pages, columnTypes, tabledir, part, fmt)
+        if table in appendOnly and nRows:
+            state[table] = lastRowId
+        exported[table] = nRows
+
+    saveState(stateFile, state)
+    return exported
+
+
+# npz dtype and fill value of NULLs per affinity, so that no column is ever stored as a pickled object array.
+numpyTypes = dict(INTEGER=(np.int64, -1), TEXT=(str, ''), BLOB=(bytes, b''), REAL=(np.float64, np.nan))
+
+
+def affinity(declaredType):
+    """sqlite column affinity of a declared type, NUMERIC is exported as REAL."""
+    declaredType = declaredType.upper()
+    if 'INT' in declaredType:
+        return 'INTEGER'
+    if any([name in declaredType for name in ['CHAR', 'CLOB', 'TEXT']]):
+        return 'TEXT'
+    if not declaredType or 'BLOB' in declaredType:
+        return 'BLOB'
+
+    return 'REAL'
+
+
+def arrowType(declaredType):
+    """Arrow type of a sqlite declared type."""
+    return dict(INTEGER=pa.int64(), TEXT=pa.string(), BLOB=pa.binary(), REAL=pa.float64())[affinity(declaredType)]
+
+
+def numpyColumn(values, declaredType):
+    """Typed array of a column for the npz fallback, NULLs are replaced by the fill value of its affinity."""
+    dtype, fill = numpyTypes[affinity(declaredType)]
+    return np.array([fill if value is None else value for value in values], dtype=dtype)
+
+
+def writeParts(pages, columnTypes, tabledir, part, fmt):
+    """Write every page, return the number of rows and the last rowid.
+
+    The arrow schema and the npz dtypes come from the declared column types, so a chunk where a column is all NULL
+    still matches them.
+    If anything fails, the parts written by this call are removed.
+    """
+    nRows, lastRowId, writer = 0, 0, None
+    columns = [column for column, declaredType in columnTypes]
+    filepaths = [os.path.join(tabledir, 'part-%06d.%s' % (part, extensions[fmt]))]
+    schema = None if fmt == 'npz' else pa.schema([(column, arrowType(declaredType))
+                                                  for column, declaredType in columnTypes])
+
+    try:
+        for rows in pages:
+            rowids, *values = zip(*rows)
+            chunk = dict(zip(columns, values))
+
+            if fmt == 'npz':
+                np.savez(filepaths[-1], **dict([(column, numpyColumn(chunk[column], declaredType))
+                                                 for column, declaredType in columnTypes]))
+                part += 1
+                filepaths.append(os.path.join(tabledir, 'part-%06d.%s' % (part, extensions[fmt])))
+            else:
+                if writer is None:
+                    writer = pq.ParquetWriter(filepaths[-1], schema) if fmt == 'parquet' else \
+                        pa.ipc.new_file(filepaths[-1], schema)
+                writer.write_table(pa.Table.from_pydict(chunk, schema=schema))
+
+            nRows += len(rows)
+            lastRowId = rowids[-1]
+
+    except:
+        if writer is not None:
+            writer.close()
+            writer = None
+        for filepath in filepaths:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        raise
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return nRows, lastRowId
+
+
+def loadState(stateFile):
+    try:
+        with open(stateFile, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def saveState(stateFile, state):
+    tmpFile = '%s.tmp' % stateFile
+    with open(tmpFile, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmpFile, stateFile)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dbname', type=str, help='logbook database name')
+    parser.add_argument('outdir', type=str, help='output directory')
+    parser.add_argument('--format', default='parquet', type=str, choices=sorted(extensions), help='output format')
+    parser.add_argument('--chunkSize', default=10000, type=int, help='rows per chunk')
+    parser.add_argument('--full', action='store_true', help='export every row, not only the new ones')
+    args = parser.parse_args()
+
+    exported = export(args.dbname, args.outdir, fmt=args.format, chunkSize=args.chunkSize, incremental=not args.full)
+    for table, nRows in exported.items():
+        print('%s : %d rows exported' % (table, nRows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from spsaitActor.utils.logbook import Logbook
+
+
+class Journal(object):
+    """Append-only JSON-lines record of an experiment and of each of its subCmd transitions.
+
+    Every line is flushed and fsync'd, so the logbook record can be rebuilt after a crash.
+    """
+    crashMsg = 'actor stopped before the end of the experiment'
+    # sequence subCmds described per line, a lazy sequence is never held in memory as a whole.
+    chunkSize = 1000
+
+    def __init__(self, rootdir, dbname, experimentId, append=False):
+        """append is only given for the run the journal belongs to (resume, recovery), a new run needs a new file."""
+        object.__init__(self)
+        self.filepath = os.path.join(rootdir, '%s-%06d.jsonl' % (dbname, experimentId))
+
+        if not append and os.path.exists(self.filepath):
+            raise RuntimeError('%s already exists, %s experimentId=%d was already used' % (self.filepath, dbname,
+                                                                                          experimentId))
+        self.lock = threading.Lock()
+        self.file = None
+
+    @staticmethod
+    def rootdir(actor):
+        return os.path.join(os.path.expandvars(actor.config.get('spsait', 'datadir')), 'journal')
+
+    @staticmethod
+    def encode(obj):
+        """numpy values of a recipe are journaled as plain numbers and lists."""
+        if hasattr(obj, 'tolist'):
+            return obj.tolist()
+
+        raise TypeError('%r is not JSON serializable' % obj)
+
+    def write(self, event, **kwargs):
+        line = '%s\n' % json.dumps(dict(event=event, time=time.time(), **kwargs), default=Journal.encode)
+
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+                self.file = open(self.filepath, 'a+')
+                if self.file.tell():
+                    # terminate a line truncated by a crash before appending.
+                    self.file.seek(self.file.tell() - 1)
+                    line = line if self.file.read(1) == '\n' else '\n%s' % line
+
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def experiment(self, experiment, recipe=None):
+        """Header of a run, the sequence is either its recipe or the sequence chunks which follow."""
+        self.write('experiment',
+                   dbname=experiment.dbname,
+                   experimentId=experiment.id,
+                   seqtype=experiment.seqtype,
+                   cmdStr=experiment.cmdStr,
+                   name=experiment.name,
+                   comments=experiment.comments,
+                   startdate=experiment.startdate,
+                   head=[subCmd.describe() for subCmd in experiment.head],
+                   tail=[subCmd.describe() for subCmd in experiment.tail],
+                   recipe=recipe)
+
+    def sequence(self, subCmds):
+        self.write('sequence', subCmds=subCmds)
+
+    def start(self, subCmd):
+        self.write('start', id=subCmd.id)
+
+    def finish(self, subCmd):
+        self.write('finish', id=subCmd.id, didFail=subCmd.didFail, visit=subCmd.visit, reply=subCmd.cleanReply)
+
+    def error(self, cmdError):
+        self.write('error', cmdError=cmdError)
+
+    def stored(self):
+        self.write('stored')
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    @staticmethod
+    def load(filepath):
+        """Replay a journal file, return the experiment header updated with cmdError, finished subCmds and stored.
+
+        A resumed run appends a new header with the same startdate, any other header starts the state over.
+        """
+        state = dict(cmdError='', finished=dict(), stored=False)
+
+        with open(filepath, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                event = record.pop('event')
+                if event == 'experiment':
+                    if record.get('startdate') != state.get('startdate', record.get('startdate')):
+                        state['finished'] = dict()
+                    state['sequence'] = record.pop('sequence', [])
+                    state['recipe'] = record.pop('recipe', None)
+                    state.update(record)
+                    state['cmdError'] = ''
+                    state['stored'] = False
+                elif event == 'sequence':
+                    state['sequence'].extend(record['subCmds'])
+                elif event == 'finish':
+                    state['finished'][record['id']] = record
+                elif event == 'error':
+                    state['cmdError'] = record['cmdError']
+                elif event == 'stored':
+                    state['stored'] = True
+
+        return state
+
+    @staticmethod
+    def isStored(filepath, tailSize=4096):
+        """Whether the last line of the journal is stored, only the end of the file is read."""
+        with open(filepath, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - tailSize, 0))
+            lines = f.read().splitlines()
+
+        try:
+            return json.loads(lines[-1].decode())['event'] == 'stored'
+        except (IndexError, ValueError, KeyError):
+            return False
+
+    @staticmethod
+    def find(rootdir, experimentId, dbname=None):
+        """Return the journal filepath of experimentId, dbname is only required if the id is ambiguous."""
+        pattern = '%s-%06d.jsonl' % ('*' if dbname is None else dbname, experimentId)
+        filepaths = glob.glob(os.path.join(rootdir, pattern))
+
+        if not filepaths:
+            raise ValueError('no journal found for experimentId=%d' % experimentId)
+        if len(filepaths) > 1:
+            raise ValueError('experimentId=%d is ambiguous, dbname is required' % experimentId)
+
+        return filepaths[0]
+
+    @staticmethod
+    def recover(rootdir):
+        """Write the logbook record of every journaled experiment which was never stored, return their ids.
+
+        Stored journals are recognized from their last line, they are never parsed.
+        """
+        recovered = []
+
+        for filepath in sorted(glob.glob(os.path.join(rootdir, '*.jsonl'))):
+            try:
+                if Journal.isStored(filepath):
+                    continue
+
+                state = Journal.load(filepath)
+                if state['stored'] or 'experimentId' not in state:
+                    continue
+
+                dbname, experimentId = state['dbname'], state['experimentId']
+                visits = [record['visit'] for record in state['finished'].values() if record['visit'] != -1]
+
+                if visits:
+                    Logbook.newExperiment(dbname=dbname,
+                                          experimentId=experimentId,
+                                          visitStart=min(visits),
+                                          visitEnd=max(visits),
+                                          seqtype=state['seqtype'],
+                                          cmdStr=state['cmdStr'],
+                                          name=state['name'],
+                                          comments=state['comments'],
+                                          startdate=state['startdate'],
+                                          cmdError=state['cmdError'] if state['cmdError'] else Journal.crashMsg)
+                else:
+                    Logbook.releaseExperimentId(dbname=dbname, experimentId=experimentId)
+
+                Logbook.flush()
+                Journal(rootdir, dbname, experimentId, append=True).stored()
+                recovered.append((dbname, experimentId))
+
+            except Exception as e:
+                logging.getLogger('journal').exception('failed to recover %s : %s', filepath, e)
+
+        return recovered
@@ -1,87 +1,367 @@
+import itertools
+import logging
+import queue
 import sqlite3
-
-from spsaitActor.utils import cleanStr
+import threading
 
 
 class Logbook:
     path = '///software/ait/'
+    busyTimeout = 30
+    # set by the actor from its config, None leaves the journal mode of the db as it is (export, queries).
+    # WAL is only safe if every process opening the db runs on this host, the rollback journal is kept on NFS.
+    journalMode = None
+    journalModes = ['DELETE', 'TRUNCATE', 'PERSIST', 'WAL']
+
+    lock = threading.RLock()
+    connections = dict()
+
+    pending = queue.Queue()
+    writer = None
+
+    nextExperimentIds = dict()
+    # cmdError of the placeholder row of an experiment without any visit, the row is kept so its id is never reused.
+    releasedMsg = 'no visit, experimentId released'
+
+    insertExperiment = """INSERT INTO Experiment VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    # experimentId is not declared unique (it is indexed), a reserved row is updated and a row is only inserted if
+    # there is none.
+    updateExperiment = """UPDATE Experiment SET name = ?, visitStart = ?, visitEnd = ?, seqtype = ?, cmdStr = ?,
+                          comments = ?, anomalies = ?, startdate = ?, cmdError = ? WHERE experimentId = ?"""
+    insertMissingExperiment = """INSERT INTO Experiment SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                                 WHERE NOT EXISTS (SELECT 1 FROM Experiment WHERE experimentId = ?)"""
+    insertExposure = """INSERT INTO Exposure VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    insertCamExposure = """INSERT INTO CamExposure VALUES (?, ?, ?, ?)"""
+    insertSubCmdTiming = """INSERT INTO SubCmdTiming VALUES (?, ?, ?, ?, ?)"""
+    editableColumns = ['name', 'comments', 'anomalies']
+
+    tables = dict(SubCmdTiming='(actor TEXT, verb TEXT, exptime REAL, duration REAL, date TEXT)')
+
+    indexes = dict(Experiment_experimentId='Experiment (experimentId)',
+                   Experiment_seqtype='Experiment (seqtype)',
+                   Experiment_startdate='Experiment (startdate)',
+                   Experiment_visits='Experiment (visitStart, visitEnd)',
+                   Exposure_visit='Exposure (visit)',
+                   CamExposure_exposureId='CamExposure (exposureId)',
+                   SubCmdTiming_key='SubCmdTiming (actor, verb, exptime)')
+
+    @staticmethod
+    def filepath(dbname):
+        return '%s/%s.db' % (Logbook.path, dbname)
+
+    @staticmethod
+    def connect(dbname):
+        """Return the long-lived connection to dbname, opening it on first use."""
+        with Logbook.lock:
+            try:
+                return Logbook.connections[dbname]
+            except KeyError:
+                pass
+
+            if Logbook.journalMode not in [None] + Logbook.journalModes:
+                raise ValueError('unknown logbook journal mode : %s' % Logbook.journalMode)
+
+            conn = sqlite3.connect(Logbook.filepath(dbname), timeout=Logbook.busyTimeout, check_same_thread=False)
+            if Logbook.journalMode is not None:
+                conn.execute('PRAGMA journal_mode=%s' % Logbook.journalMode)
+            # NORMAL only keeps the db consistent with WAL, a rollback journal keeps the default FULL.
+            if Logbook.journalMode == 'WAL':
+                conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=%d' % (1000 * Logbook.busyTimeout))
+            Logbook.createTables(conn)
+            Logbook.createIndexes(conn)
+            Logbook.connections[dbname] = conn
+
+            return conn
+
+    @staticmethod
+    def createTables(conn):
+        """Create the tables added after the original schema."""
+        for table, columns in Logbook.tables.items():
+            with conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS %s %s""" % (table, columns))
+
+    @staticmethod
+    def createIndexes(conn):
+        """Create the secondary indexes used by the queries, tables missing from this db are skipped."""
+        for indexName, indexOn in Logbook.indexes.items():
+            try:
+                with conn:
+                    conn.execute("""CREATE INDEX IF NOT EXISTS %s ON %s""" % (indexName, indexOn))
+            except sqlite3.OperationalError:
+                pass
+
+    @staticmethod
+    def readOnly(dbname):
+        """Open a separate read-only connection, so long queries neither block nor see half of a write batch."""
+        return sqlite3.connect('file:%s?mode=ro' % Logbook.filepath(dbname), uri=True, timeout=Logbook.busyTimeout)
+
+    @staticmethod
+    def close():
+        """Flush pending rows, stop the writer and close every opened connection, called at actor shutdown."""
+        if Logbook.writer is not None:
+            Logbook.pending.put(None)
+            Logbook.writer.join()
+            Logbook.writer = None
+
+        with Logbook.lock:
+            for dbname, conn in list(Logbook.connections.items()):
+                conn.close()
+                Logbook.connections.pop(dbname)
 
     @staticmethod
     def newExperiment(dbname, experimentId, name, visitStart, visitEnd, seqtype, cmdStr, comments, startdate, cmdError,
                       anomalies=''):
+        Logbook.newRow(dbname=dbname,
+                       sqlRequest=Logbook.updateExperiment,
+                       params=(name, visitStart, visitEnd, seqtype, cmdStr, comments, anomalies, startdate, cmdError,
+                               experimentId))
+        Logbook.newRow(dbname=dbname,
+                       sqlRequest=Logbook.insertMissingExperiment,
+                       params=(experimentId, name, visitStart, visitEnd, seqtype, cmdStr, comments, anomalies,
+                               startdate, cmdError, experimentId))
+
+    @staticmethod
+    def reserveExperimentId(dbname, name, seqtype, cmdStr, comments, startdate):
+        """Atomically insert a placeholder row (visitStart=visitEnd=-1) and return its experimentId.
+
+        The next id is cached per dbname, the table is only scanned again if another writer took it meanwhile.
+        """
+        Logbook.flush()
+        with Logbook.lock:
+            conn = Logbook.connect(dbname)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                experimentId = Logbook.nextExperimentIds.get(dbname)
+                if experimentId is None or conn.execute("""SELECT 1 FROM Experiment WHERE experimentId = ?""",
+                                                        (experimentId,)).fetchone():
+                    (lastId,) = conn.execute("""SELECT MAX(experimentId) FROM Experiment""").fetchone()
+                    experimentId = 1 if lastId is None else lastId + 1
+
+                conn.execute(Logbook.insertExperiment,
+                             (experimentId, name, -1, -1, seqtype, cmdStr, comments, '', startdate, ''))
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+
+            Logbook.nextExperimentIds[dbname] = experimentId + 1
 
-        name = cleanStr(name)
-        cmdStr = cleanStr(cmdStr)
-        comments = cleanStr(comments)
-        cmdError = cleanStr(cmdError)
-        anomalies = cleanStr(anomalies)
-        sqlRequest = """INSERT INTO Experiment VALUES (%i, "%s", %i, %i, "%s", "%s", "%s", "%s", "%s", "%s");""" % (
-            experimentId,
-            name,
-            visitStart,
-            visitEnd,
-            seqtype,
-            cmdStr,
-            comments,
-            anomalies,
-            startdate,
-            cmdError)
-        Logbook.newRow(dbname=dbname, sqlRequest=sqlRequest)
+        return experimentId
+
+    @staticmethod
+    def releaseExperimentId(dbname, experimentId):
+        """Mark the placeholder row of an experiment which did not produce any visit as released.
+
+        The row stays as a tombstone, MAX(experimentId) keeps counting it and the id is never given again.
+        """
+        Logbook.newRow(dbname=dbname,
+                       sqlRequest="""UPDATE Experiment SET cmdError = ? WHERE experimentId = ? AND visitStart = -1""",
+                       params=(Logbook.releasedMsg, experimentId))
 
     @staticmethod
     def newExposure(exposureId, site, visit, obsdate, exptime, exptype, quality='junk'):
+        Logbook.newExposures([(exposureId, site, visit, obsdate, exptime, exptype, quality)])
 
-        sqlRequest = """INSERT INTO Exposure VALUES ("%s","%s", %i, "%s", %.3f, "%s", "%s");""" % (exposureId,
-                                                                                                   site,
-                                                                                                   visit,
-                                                                                                   obsdate,
-                                                                                                   exptime,
-                                                                                                   exptype,
-                                                                                                   quality)
-        Logbook.newRow(dbname='experimentLog', sqlRequest=sqlRequest)
+    @staticmethod
+    def newExposures(rows):
+        """Insert (exposureId, site, visit, obsdate, exptime, exptype, quality) rows in a single call."""
+        Logbook.newRows(dbname='experimentLog', sqlRequest=Logbook.insertExposure, rows=rows)
 
     @staticmethod
     def newCamExposure(camExposureId, exposureId, smId, arm):
-        sqlRequest = """INSERT INTO CamExposure VALUES ("%s","%s", %i, "%s");""" % (camExposureId,
-                                                                                    exposureId,
-                                                                                    smId,
-                                                                                    arm)
+        Logbook.newCamExposures([(camExposureId, exposureId, smId, arm)])
 
-        Logbook.newRow(dbname='experimentLog', sqlRequest=sqlRequest)
+    @staticmethod
+    def newCamExposures(rows):
+        """Insert (camExposureId, exposureId, smId, arm) rows, typically every camera of a visit, in a single call."""
+        Logbook.newRows(dbname='experimentLog', sqlRequest=Logbook.insertCamExposure, rows=rows)
 
     @staticmethod
-    def newRow(dbname, sqlRequest):
-        conn = sqlite3.connect('%s/%s.db' % (Logbook.path, dbname))
-        c = conn.cursor()
-        try:
-            c.execute(sqlRequest)
-            conn.commit()
+    def newSubCmdTiming(actor, verb, exptime, duration, date):
+        Logbook.newRow(dbname='experimentLog',
+                       sqlRequest=Logbook.insertSubCmdTiming,
+                       params=(actor, verb, exptime, duration, date))
+
+    @staticmethod
+    def newRow(dbname, sqlRequest, params=()):
+        """Enqueue a write request and return at once, the writer thread will commit it."""
+        Logbook.newRows(dbname=dbname, sqlRequest=sqlRequest, rows=[params])
 
-        except sqlite3.IntegrityError:
-            pass
+    @staticmethod
+    def newRows(dbname, sqlRequest, rows):
+        """Enqueue the same statement for every params tuple in rows."""
+        if Logbook.writer is None:
+            with Logbook.lock:
+                if Logbook.writer is None:
+                    Logbook.writer = threading.Thread(target=Logbook.writeLoop, name='logbookWriter', daemon=True)
+                    Logbook.writer.start()
+
+        Logbook.pending.put((dbname, sqlRequest, [tuple(row) for row in rows]))
+
+    @staticmethod
+    def flush():
+        """Block until every enqueued row has been committed."""
+        if Logbook.writer is not None:
+            Logbook.pending.join()
+
+    @staticmethod
+    def writeLoop():
+        doExit = False
+        while not doExit:
+            requests = [Logbook.pending.get()]
+            while True:
+                try:
+                    requests.append(Logbook.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            doExit = None in requests
+            try:
+                Logbook.writeRequests([request for request in requests if request is not None])
+            except Exception as e:
+                logging.getLogger('logbook').exception('failed to write %d requests : %s', len(requests), e)
+            finally:
+                for __ in requests:
+                    Logbook.pending.task_done()
+
+    @staticmethod
+    def writeRequests(requests):
+        """Commit requests in one transaction per database, runs of identical statements go through executemany."""
+        for dbname, dbRequests in itertools.groupby(sorted(requests, key=lambda req: req[0]), key=lambda req: req[0]):
+            dbRequests = list(dbRequests)
+            with Logbook.lock:
+                conn = Logbook.connect(dbname)
+                try:
+                    with conn:
+                        for sqlRequest, group in itertools.groupby(dbRequests, key=lambda req: req[1]):
+                            conn.executemany(sqlRequest, itertools.chain.from_iterable(rows for __, __, rows in group))
+
+                except sqlite3.Error:
+                    Logbook.writeOneByOne(conn, dbRequests)
+
+    @staticmethod
+    def writeOneByOne(conn, requests):
+        """Fallback when a batch is rejected, so that a single bad row does not drop its neighbours."""
+        for __, sqlRequest, rows in requests:
+            for params in rows:
+                try:
+                    with conn:
+                        conn.execute(sqlRequest, params)
+
+                except sqlite3.IntegrityError:
+                    pass
+
+                except sqlite3.Error as e:
+                    logging.getLogger('logbook').warning('%s failed : %s', sqlRequest, e)
+
+    @staticmethod
+    def fetchone(dbname, sqlRequest, params=()):
+        Logbook.flush()
+        with Logbook.lock:
+            return Logbook.connect(dbname).execute(sqlRequest, params).fetchone()
 
     @staticmethod
     def lastExperimentId(dbname):
-        conn = sqlite3.connect('%s/%s.db' % (Logbook.path, dbname))
-        c = conn.cursor()
-        c.execute("""SELECT MAX(experimentId) FROM Experiment""")
-        (experimentId,) = c.fetchone()
+        (experimentId,) = Logbook.fetchone(dbname, """SELECT MAX(experimentId) FROM Experiment""")
         experimentId = experimentId if experimentId is not None else 0
 
         return experimentId
 
     @staticmethod
     def setColumnValue(dbname, experimentId, column, value):
-        sqlRequest = """UPDATE Experiment SET %s = "%s" WHERE experimentId=%i""" % (column,
-                                                                                    cleanStr(value),
-                                                                                    experimentId)
-        Logbook.newRow(dbname=dbname, sqlRequest=sqlRequest)
+        if column not in Logbook.editableColumns:
+            raise ValueError('%s column cannot be edited' % column)
+
+        Logbook.newRow(dbname=dbname,
+                       sqlRequest="""UPDATE Experiment SET %s = ? WHERE experimentId = ?""" % column,
+                       params=(value, experimentId))
 
     @staticmethod
     def buildCmdStr(dbname, experimentId):
-        conn = sqlite3.connect('%s/%s.db' % (Logbook.path, dbname))
-        c = conn.cursor()
-        c.execute("""SELECT name, comments, cmdStr FROM Experiment WHERE experimentId=%i """ % experimentId)
+        return Logbook.fetchone(dbname, """SELECT name, comments, cmdStr FROM Experiment WHERE experimentId = ?""",
+                                params=(experimentId,))
 
-        return c.fetchone()
+    @staticmethod
+    def query(dbname, sqlRequest, params=(), pageSize=100):
+        """Run a select on a read-only connection and yield the result by pages of pageSize rows."""
+        Logbook.flush()
+        conn = Logbook.readOnly(dbname)
+        try:
+            cursor = conn.execute(sqlRequest, params)
+            while True:
+                rows = cursor.fetchmany(pageSize)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def columns(dbname, table):
+        """Return the column names of table."""
+        return [column for column, declaredType in Logbook.columnTypes(dbname, table)]
+
+    @staticmethod
+    def columnTypes(dbname, table):
+        """Return the (name, declared type) of each column of table."""
+        conn = Logbook.readOnly(dbname)
+        try:
+            columnTypes = [(row[1], row[2]) for row in conn.execute("""PRAGMA table_info(%s)""" % table)]
+        finally:
+            conn.close()
+
+        if not columnTypes:
+            raise ValueError('%s table does not exist in %s' % (table, dbname))
+
+        return columnTypes
+
+    @staticmethod
+    def queryExperiments(dbname, seqtype=None, since=None, until=None, name=None, visitStart=None, visitEnd=None,
+                         pageSize=100):
+        """Yield pages of Experiment rows matching every given filter.
+
+        since/until are compared to startdate (isoformat), name is a substring, [visitStart, visitEnd] must overlap.
+        Placeholder rows of running, crashed or released experiments are left out.
+        """
+        where, params = ['visitStart != -1'], []
+
+        if seqtype is not None:
+            where.append('seqtype = ?')
+            params.append(seqtype)
+        if since is not None:
+            where.append('startdate >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('startdate <= ?')
+            params.append(until)
+        if name is not None:
+            where.append('instr(name, ?) > 0')
+            params.append(name)
+        if visitStart is not None:
+            where.append('visitEnd >= ?')
+            params.append(visitStart)
+        if visitEnd is not None:
+            where.append('visitStart <= ?')
+            params.append(visitEnd)
+
+        sqlRequest = """SELECT * FROM Experiment WHERE %s ORDER BY experimentId""" % ' AND '.join(where)
+
+        return Logbook.query(dbname, sqlRequest, params=params, pageSize=pageSize)
+
+    @staticmethod
+    def queryExposures(visitStart, visitEnd, exptype=None, pageSize=100):
+        """Yield pages of (Exposure + CamExposure) rows for visits in [visitStart, visitEnd]."""
+        sqlRequest = """SELECT * FROM Exposure INNER JOIN CamExposure ON Exposure.exposureId = CamExposure.exposureId
+                        WHERE visit >= ? AND visit <= ? %s ORDER BY visit""" % ('AND exptype = ?' if exptype else '')
+        params = [visitStart, visitEnd] + ([exptype] if exptype else [])
+
+        return Logbook.query('experimentLog', sqlRequest, params=params, pageSize=pageSize)
+
+    @staticmethod
+    def querySubCmdTimings(limit=100000, pageSize=10000):
+        """Yield pages of the latest (actor, verb, exptime, duration) rows, most recent first."""
+        Logbook.connect('experimentLog')
+        sqlRequest = """SELECT actor, verb, exptime, duration FROM SubCmdTiming ORDER BY rowid DESC LIMIT ?"""
 
+        return Logbook.query('experimentLog', sqlRequest, params=(limit,), pageSize=pageSize)
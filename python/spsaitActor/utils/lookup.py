@@ -0,0 +1,91 @@
+import bisect
+import sqlite3
+import threading
+
+import spsaitActor.utils.storage as storage
+from spsaitActor.utils.logbook import Logbook
+
+
+class VisitIndex(object):
+    """Sorted in-memory interval index over the (visitStart, visitEnd) of every logbook experiment."""
+
+    def __init__(self):
+        object.__init__(self)
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.starts = []
+        self.entries = []
+        self.maxEnds = []
+        self.keys = dict()
+
+    def load(self):
+        """(Re)build the index from every logbook database."""
+        entries = []
+        for dbname in storage.databases():
+            try:
+                for rows in Logbook.queryExperiments(dbname, visitStart=0, pageSize=10000):
+                    entries.extend([(visitStart, visitEnd, dbname, experimentId)
+                                    for experimentId, __, visitStart, visitEnd, *__ in rows])
+            except sqlite3.Error:
+                pass
+
+        with self.lock:
+            self.entries = sorted(entries)
+            self.keys = dict([((dbname, experimentId), (visitStart, visitEnd, dbname, experimentId))
+                              for visitStart, visitEnd, dbname, experimentId in self.entries])
+            self.reindex(0)
+            self.loaded = True
+
+    def reindex(self, start):
+        """Refresh starts and running max of visitEnd from position start, needed with overlapping ranges."""
+        del self.starts[start:]
+        del self.maxEnds[start:]
+        maxEnd = self.maxEnds[-1] if self.maxEnds else -1
+
+        for visitStart, visitEnd, __, __ in self.entries[start:]:
+            maxEnd = max(maxEnd, visitEnd)
+            self.starts.append(visitStart)
+            self.maxEnds.append(maxEnd)
+
+    def insert(self, dbname, experimentId, visitStart, visitEnd):
+        """Add or update a stored experiment, new experiments are appended at the end in O(1)."""
+        with self.lock:
+            if not self.loaded:
+                return
+
+            start = len(self.entries)
+            previous = self.keys.pop((dbname, experimentId), None)
+            if previous is not None:
+                start = bisect.bisect_left(self.entries, previous)
+                self.entries.pop(start)
+
+            entry = (visitStart, visitEnd, dbname, experimentId)
+            position = bisect.bisect_right(self.entries, entry)
+            self.entries.insert(position, entry)
+            self.keys[(dbname, experimentId)] = entry
+            self.reindex(min(start, position))
+
+    def lookup(self, visit):
+        """Return [(dbname, experimentId)] of every experiment whose visit range contains visit."""
+        if not self.loaded:
+            self.load()
+
+        with self.lock:
+            found = []
+            i = bisect.bisect_right(self.starts, visit) - 1
+
+            while i >= 0 and self.maxEnds[i] >= visit:
+                __, visitEnd, dbname, experimentId = self.entries[i]
+                if visitEnd >= visit:
+                    found.append((dbname, experimentId))
+                i -= 1
+
+            return found[::-1]
+
+
+visitIndex = VisitIndex()
+
+
+def experimentFromVisit(visit):
+    """Return [(dbname, experimentId)] of the experiment(s) which produced visit, empty if unknown."""
+    return visitIndex.lookup(visit)
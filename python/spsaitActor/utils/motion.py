@@ -0,0 +1,165 @@
+import re
+from collections import OrderedDict
+
+from spsaitActor.utils.durations import durationModel
+from spsaitActor.utils.experiment import Experiment
+from spsaitActor.utils.sequencing import CmdList, LazyCmdList, SubCmd
+from spsaitActor.utils.slit import isSlitMove, slitAbsolute, slitRelative
+
+# moves setting the whole position of a device, sending the same one twice in a row moves nothing.
+absoluteMoves = [re.compile(r'^xcu_\w+ motors moveCcd .* abs$')]
+
+
+def isMove(subCmd):
+    return isSlitMove(subCmd) or any([pattern.match(subCmd.fullCmd) for pattern in absoluteMoves])
+
+
+def finalHomes(subCmds):
+    """Positions of the homes which are the last slit move of their actor in the sequence."""
+    last = dict()
+    for position, subCmd in enumerate(subCmds):
+        if isSlitMove(subCmd):
+            last[subCmd.actor] = (position, subCmd.cmdStr == 'slit home')
+
+    return set([position for position, isHome in last.values() if isHome])
+
+
+class Slit(object):
+    """Slit position as shift and dither offsets in a frame, the start position, home or an absolute position."""
+
+    def __init__(self, frame='start'):
+        object.__init__(self)
+        self.reset(frame)
+
+    def reset(self, frame):
+        self.frame = frame
+        self.shift = 0.
+        self.dither = 0.
+        # relative moves sent since the last home.
+        self.nMoves = 0
+
+
+class MotionOptimizer(object):
+    """Replace the slit moves of each step by the minimal relative moves, and drop absolute moves which repeat.
+
+    A home in the sequence is only sent if the slit is not already in the home frame or after homeEvery relative
+    moves, the accuracy of the relative moves is not trusted beyond that. A home ending the sequence is always sent,
+    the slit is left at a known position.
+    """
+
+    def __init__(self, homeEvery=10):
+        object.__init__(self)
+        self.homeEvery = homeEvery
+
+    def optimize(self, sequence):
+        """Return the optimized sequence, moves before and after, and the estimated time saved."""
+        __, movesBefore, durationBefore = self.summarize(sequence)
+        nSubCmds, movesAfter, durationAfter = self.summarize(self.run(sequence))
+
+        if isinstance(sequence, LazyCmdList):
+            optimized = self.lazy(sequence, length=nSubCmds)
+        else:
+            optimized = CmdList()
+            optimized.extend(self.run(sequence))
+
+        return optimized, movesBefore, movesAfter, durationBefore - durationAfter
+
+    def lazy(self, sequence, length):
+        """Optimized lazy sequence, its recipe is the recipe of sequence along with the optimizer settings."""
+        recipe = None if sequence.recipe is None else dict(sequence.recipe, homeEvery=self.homeEvery, length=length)
+        return LazyCmdList(lambda: self.run(sequence), length=length, recipe=recipe)
+
+    @staticmethod
+    def summarize(subCmds):
+        """Number of subCmds and moves, and estimated duration, in a single pass."""
+        counts = dict(subCmds=0, moves=0)
+
+        def counted():
+            for subCmd in subCmds:
+                counts['subCmds'] += 1
+                counts['moves'] += int(isMove(subCmd))
+                yield subCmd
+
+        duration = durationModel.total(Experiment.steps(counted()))
+        return counts['subCmds'], counts['moves'], duration
+
+    def run(self, subCmds):
+        """Yield the optimized subCmds, non-move subCmds are yielded untouched."""
+        intended = dict()
+        actual = dict()
+        lastAbsolute = dict()
+        forced = finalHomes(subCmds)
+        position = -1
+
+        for step in Experiment.steps(subCmds):
+            # per slit actor, first move of the step, used as a template, and whether a home was requested.
+            touched = OrderedDict()
+            # slit actors whose home ends the sequence.
+            final = set()
+
+            for subCmd in step:
+                position += 1
+                if isSlitMove(subCmd):
+                    slit = intended.setdefault(subCmd.actor, Slit())
+                    actual.setdefault(subCmd.actor, Slit())
+                    template, homed = touched.get(subCmd.actor, (subCmd, False))
+                    relative = slitRelative.match(subCmd.cmdStr)
+                    absolute = slitAbsolute.match(subCmd.cmdStr)
+
+                    if subCmd.cmdStr == 'slit home':
+                        intended[subCmd.actor] = Slit('home')
+                        touched[subCmd.actor] = (template, True)
+                        if position in forced:
+                            final.add(subCmd.actor)
+                    elif relative is not None:
+                        axis, value = relative.groups()
+                        setattr(slit, axis, getattr(slit, axis) + float(value))
+                        touched[subCmd.actor] = (template, homed)
+                    elif absolute is not None:
+                        intended[subCmd.actor] = Slit(absolute.group(1))
+                        touched[subCmd.actor] = (template, homed)
+                    else:
+                        # any other slit command is sent as is, the position is unknown afterwards.
+                        if subCmd.actor in touched:
+                            yield from self.moves(intended[subCmd.actor], actual[subCmd.actor],
+                                                  *touched.pop(subCmd.actor))
+                        yield subCmd
+                        intended[subCmd.actor] = Slit(frame=object())
+                        actual[subCmd.actor] = Slit(frame=intended[subCmd.actor].frame)
+                    continue
+
+                if any([pattern.match(subCmd.fullCmd) for pattern in absoluteMoves]):
+                    if lastAbsolute.get(subCmd.actor) != subCmd.cmdStr:
+                        lastAbsolute[subCmd.actor] = subCmd.cmdStr
+                        yield subCmd
+                    continue
+
+                lastAbsolute.pop(subCmd.actor, None)
+                yield subCmd
+
+            for actor, (template, homed) in touched.items():
+                yield from self.moves(intended[actor], actual[actor], template, homed, force=actor in final)
+
+    def moves(self, intended, actual, template, homed, force=False):
+        """Yield the moves bringing actual to intended, actual is updated on the way, force always sends a home."""
+
+        def move(cmdStr):
+            return SubCmd(actor=template.actor, cmdStr=cmdStr, timeLim=template.timeLim, tempo=template.tempo,
+                          group=template.group, resources=template.resources)
+
+        if intended.frame == 'home' and (force or actual.frame != 'home' or
+                                         (homed and actual.nMoves >= self.homeEvery)):
+            actual.reset('home')
+            yield move('slit home')
+        elif intended.frame != actual.frame:
+            actual.reset(intended.frame)
+            yield move('slit move absolute %s' % intended.frame)
+
+        for axis in ['shift', 'dither']:
+            delta = round(getattr(intended, axis) - getattr(actual, axis), 5)
+            if not delta:
+                continue
+
+            setattr(actual, axis, getattr(intended, axis))
+            actual.nMoves += 1
+            yield move('slit %s=%.5f pixels' % (axis, delta))
@@ -0,0 +1,59 @@
+import re
+from functools import partial
+
+
+def isExposure(subCmd):
+    return subCmd.actor == 'sps' and subCmd.cmdStr.startswith('expose')
+
+
+def exposureCams(subCmd, defaultCams):
+    match = re.search(r'cams?=(\S+)', subCmd.cmdStr)
+    return match.group(1).split(',') if match else defaultCams
+
+
+class ShutterWatcher(object):
+    """Watch ccd exposureState during an exposure, closed once every camera went from integrating to another state.
+
+    If a ccd model is missing, the watcher is never closed and the pipeline falls back to the end of the exposure.
+    """
+
+    def __init__(self, actor, subCmd, condition):
+        object.__init__(self)
+        self.condition = condition
+        self.integrating = set()
+        self.readout = set()
+        self.callbacks = []
+
+        cams = exposureCams(subCmd, defaultCams=actor.cams)
+        try:
+            keyVars = [(cam, actor.models['ccd_%s' % cam].keyVarDict['exposureState']) for cam in cams]
+        except KeyError:
+            keyVars = []
+
+        self.cams = set([cam for cam, __ in keyVars])
+        self.available = bool(keyVars)
+
+        for cam, keyVar in keyVars:
+            callback = partial(self.update, cam)
+            keyVar.addCallback(callback, callNow=False)
+            self.callbacks.append((keyVar, callback))
+
+    @property
+    def isClosed(self):
+        return self.available and self.readout == self.cams
+
+    def update(self, cam, keyVar, *args, **kwargs):
+        state = list(keyVar)[0]
+        with self.condition:
+            if state == 'integrating':
+                self.integrating.add(cam)
+            elif cam in self.integrating:
+                self.readout.add(cam)
+
+            self.condition.notify_all()
+
+    def close(self):
+        for keyVar, callback in self.callbacks:
+            keyVar.removeCallback(callback)
+
+        self.callbacks = []
@@ -0,0 +1,81 @@
+import itertools
+import re
+import threading
+from collections import OrderedDict
+
+import spsaitActor.utils.pipeline as pipeline
+from spsaitActor.utils.durations import DurationModel, durationModel
+from spsaitActor.utils.experiment import Experiment
+
+# quoted values are matched first and kept as is, only the bare plan keyword outside of them is removed.
+planKeyword = re.compile(r'("[^"]*"|\'[^\']*\')|\s+plan(?=\s|$)')
+
+
+def stripPlan(rawCmd):
+    """Return rawCmd without its plan keyword, the command which is run later."""
+    return planKeyword.sub(lambda match: match.group(1) or '', rawCmd)
+
+
+class Plan(object):
+    """Sequence built by a command issued with plan, nothing is sent to the hardware until it is run."""
+    ids = itertools.count(1)
+
+    def __init__(self, rawCmd, sequence, seqtype, name, comments, head, tail):
+        object.__init__(self)
+        self.id = next(Plan.ids)
+        self.rawCmd = stripPlan(rawCmd)
+        self.sequence = sequence
+        self.seqtype = seqtype
+        self.name = name
+        self.comments = comments
+        self.head = head
+        self.tail = tail
+
+    @property
+    def subCmds(self):
+        return itertools.chain(self.head, self.sequence, self.tail)
+
+    @property
+    def nSubCmds(self):
+        return len(self.head) + len(self.sequence) + len(self.tail)
+
+    @property
+    def exposures(self):
+        return [subCmd for subCmd in self.subCmds if pipeline.isExposure(subCmd)]
+
+    @property
+    def shutterTime(self):
+        return sum([DurationModel.key(subCmd.actor, subCmd.cmdStr)[2] for subCmd in self.exposures])
+
+    @property
+    def duration(self):
+        return durationModel.total(Experiment.steps(self.subCmds))
+
+    def inform(self, cmd):
+        cmd.inform('plan=%d,%s,"%s",%d,%d,%.1f,%.1f' % (self.id, self.seqtype, self.rawCmd, self.nSubCmds,
+                                                        len(self.exposures), self.duration, self.shutterTime))
+
+
+class Planner(object):
+    """Keep the latest plans until they are run."""
+    maxPlans = 20
+
+    def __init__(self):
+        object.__init__(self)
+        self.lock = threading.Lock()
+        self.plans = OrderedDict()
+
+    def add(self, plan):
+        with self.lock:
+            self.plans[plan.id] = plan
+            while len(self.plans) > self.maxPlans:
+                self.plans.popitem(last=False)
+
+        return plan
+
+    def pop(self, planId):
+        with self.lock:
+            try:
+                return self.plans.pop(planId)
+            except KeyError:
+                raise ValueError('planId=%d is unknown or was already run' % planId)
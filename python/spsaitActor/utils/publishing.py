@@ -0,0 +1,128 @@
+import threading
+import time
+
+
+class Ranges(object):
+    """Sorted, non-overlapping [first, last, didFail] ranges, adjacent ranges with the same didFail are merged."""
+
+    def __init__(self):
+        object.__init__(self)
+        self.ranges = []
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    def paint(self, first, last, didFail):
+        """Set didFail from first to last, overriding what was previously set there."""
+        ranges = [[first, last, didFail]]
+        for rFirst, rLast, rDidFail in self.ranges:
+            if rLast < first or rFirst > last:
+                ranges.append([rFirst, rLast, rDidFail])
+                continue
+            if rFirst < first:
+                ranges.append([rFirst, first - 1, rDidFail])
+            if rLast > last:
+                ranges.append([last + 1, rLast, rDidFail])
+
+        self.ranges = []
+        for rng in sorted(ranges):
+            if self.ranges and self.ranges[-1][2] == rng[2] and self.ranges[-1][1] + 1 == rng[0]:
+                self.ranges[-1][1] = rng[1]
+            else:
+                self.ranges.append(rng)
+
+
+class StatusPublisher(object):
+    """Coalesce the subCommand and status keywords of an experiment, published at most once per window.
+
+    Finished subCmds are sent as subCommands=experimentId,first,last,didFail ranges and only the latest status is
+    sent. Registrations and failure replies are published at once, in full. With window=0 every update is published
+    in full as it happens.
+    """
+
+    def __init__(self, experiment, window):
+        object.__init__(self)
+        self.experiment = experiment
+        self.window = window
+        self.lock = threading.RLock()
+        self.cmd = None
+        self.lastFlush = 0
+        self.timer = None
+        self.pending = Ranges()
+        self.statusPending = False
+        # everything published so far, replayed by spsait status.
+        self.state = Ranges()
+
+    def register(self, cmd, subCmd):
+        with self.lock:
+            subCmd.inform(cmd=cmd)
+            if subCmd.didFail != -1:
+                self.state.paint(subCmd.id, subCmd.id, subCmd.didFail)
+
+    def publish(self, cmd, subCmd, full=False):
+        """subCmd state changed, failures with a reply are published in full, other changes are coalesced."""
+        with self.lock:
+            self.state.paint(subCmd.id, subCmd.id, subCmd.didFail)
+
+            if full or not self.window or (subCmd.didFail == 1 and subCmd.cleanReply):
+                self.flush()
+                subCmd.inform(cmd=cmd)
+                return
+
+            self.pending.paint(subCmd.id, subCmd.id, subCmd.didFail)
+            self.schedule(cmd)
+
+    def publishRange(self, cmd, first, last, didFail):
+        """Subcommands from first to last all changed to didFail, only ever published as a range."""
+        with self.lock:
+            self.state.paint(first, last, didFail)
+            self.pending.paint(first, last, didFail)
+            self.schedule(cmd)
+
+    def status(self, cmd):
+        with self.lock:
+            self.statusPending = True
+            self.schedule(cmd)
+
+    def schedule(self, cmd):
+        """Flush now if the window has elapsed since the last flush, or make sure a flush is due at its end."""
+        self.cmd = cmd
+        delay = self.lastFlush + self.window - time.time()
+
+        if delay <= 0:
+            self.flush()
+        elif self.timer is None:
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if not self.pending and not self.statusPending:
+                return
+
+            for first, last, didFail in self.pending:
+                self.cmd.inform('subCommands=%d,%d,%d,%d' % (self.experiment.id, first, last, didFail))
+
+            if self.statusPending:
+                self.experiment.status(cmd=self.cmd)
+
+            self.pending = Ranges()
+            self.statusPending = False
+            self.lastFlush = time.time()
+
+    def publishState(self, cmd):
+        """Send the full state on cmd, each range published so far then the latest status."""
+        with self.lock:
+            self.flush()
+            for first, last, didFail in self.state:
+                cmd.inform('subCommands=%d,%d,%d,%d' % (self.experiment.id, first, last, didFail))
+
+        self.experiment.status(cmd=cmd)
@@ -0,0 +1,77 @@
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class ExperimentQueue(object):
+    """Ordered list of spsait commands to run back to back, saved to a JSON file on each change."""
+
+    def __init__(self, filepath):
+        object.__init__(self)
+        self.filepath = filepath
+        self.lock = threading.RLock()
+        self.running = False
+        self.items = self.load()
+        self.ids = itertools.count(max([item['id'] for item in self.items] + [0]) + 1)
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self):
+        try:
+            with open(self.filepath, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        tmpFile = '%s.tmp' % self.filepath
+        with open(tmpFile, 'w') as f:
+            json.dump(self.items, f)
+        os.replace(tmpFile, self.filepath)
+
+    def add(self, cmdStr):
+        if cmdStr.split(' ', 1)[0] in ['queue', 'resume', 'abort']:
+            raise ValueError('%s cannot be queued' % cmdStr)
+
+        with self.lock:
+            item = dict(id=next(self.ids), cmdStr=cmdStr, added=time.time())
+            self.items.append(item)
+            self.save()
+
+        return item
+
+    def position(self, queueId):
+        for position, item in enumerate(self.items):
+            if item['id'] == queueId:
+                return position
+
+        raise ValueError('queueId=%d is not in the queue' % queueId)
+
+    def remove(self, queueId):
+        with self.lock:
+            item = self.items.pop(self.position(queueId))
+            self.save()
+
+        return item
+
+    def reorder(self, queueId, position):
+        """Move queueId to position, 0 being the next experiment to run."""
+        with self.lock:
+            item = self.items.pop(self.position(queueId))
+            self.items.insert(max(position, 0), item)
+            self.save()
+
+    def pop(self):
+        """Remove and return the next experiment, it is not run again after a restart, use resume instead."""
+        with self.lock:
+            if not self.items:
+                return None
+
+            item = self.items.pop(0)
+            self.save()
+
+        return item
@@ -0,0 +1,35 @@
+class ResourceManager(object):
+    """Lock the resources (actors or devices) of each experiment for its whole duration.
+
+    All the resources of an experiment are acquired at once, so experiments cannot deadlock each other.
+    The actor stopCondition is shared, so an abort also wakes up the experiments waiting for their resources.
+    """
+
+    def __init__(self, condition):
+        object.__init__(self)
+        self.condition = condition
+        self.owners = dict()
+
+    def busy(self, resources):
+        """Return {resource: owner} of the resources which are already taken."""
+        with self.condition:
+            return dict([(resource, self.owners[resource]) for resource in resources if resource in self.owners])
+
+    def acquire(self, owner, resources, isStopped):
+        """Block until every resource is free then take them all, return False if stopped while waiting."""
+        with self.condition:
+            self.condition.wait_for(lambda: isStopped() or not any([res in self.owners for res in resources]))
+            if isStopped():
+                return False
+
+            for resource in resources:
+                self.owners[resource] = owner
+
+            return True
+
+    def release(self, owner):
+        with self.condition:
+            for resource in [resource for resource, resOwner in self.owners.items() if resOwner is owner]:
+                self.owners.pop(resource)
+
+            self.condition.notify_all()
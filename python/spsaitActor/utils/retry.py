@@ -0,0 +1,52 @@
+import re
+
+
+class RetryPolicy(object):
+    """How many times a failed subCmd is called again, and after which delay.
+
+    Only idempotent subCmds are retried, and only if the failure reply matches retryOn.
+    """
+
+    def __init__(self, maxAttempts=1, backoff=2.0, factor=2.0, retryOn=None, idempotent=False):
+        object.__init__(self)
+        self.maxAttempts = maxAttempts
+        self.backoff = backoff
+        self.factor = factor
+        self.retryOn = retryOn
+        self.idempotent = idempotent
+
+    def isRetryable(self, attempt, reply):
+        if not self.idempotent or attempt >= self.maxAttempts or self.retryOn is None:
+            return False
+
+        return re.search(self.retryOn, reply) is not None
+
+    def delay(self, attempt):
+        return self.backoff * self.factor ** (attempt - 1)
+
+    def describe(self):
+        return dict(maxAttempts=self.maxAttempts, backoff=self.backoff, factor=self.factor, retryOn=self.retryOn,
+                    idempotent=self.idempotent)
+
+
+transient = r'([Tt]ime ?out|[Tt]imed out|busy|not connected)'
+
+# exposures and relative slit moves (shift, dither, move relative) are never retried, a relative move which failed
+# half way would be applied twice.
+rules = [(re.compile(r'^sps '), RetryPolicy()),
+         (re.compile(r'^sac ccd'), RetryPolicy()),
+         (re.compile(r'^enu_sm\d+ slit (shift|dither)'), RetryPolicy()),
+         (re.compile(r'^enu_sm\d+ slit move relative'), RetryPolicy()),
+         (re.compile(r'^enu_sm\d+ '), RetryPolicy(maxAttempts=3, retryOn=transient, idempotent=True)),
+         (re.compile(r'^dcb '), RetryPolicy(maxAttempts=3, retryOn=transient, idempotent=True)),
+         (re.compile(r'^xcu_\w+ motors .* abs'), RetryPolicy(maxAttempts=2, retryOn=transient, idempotent=True)),
+         (re.compile(r'^sac move .* abs'), RetryPolicy(maxAttempts=2, retryOn=transient, idempotent=True))]
+
+
+def policy(fullCmd):
+    """Return the default retry policy of fullCmd, no retry if there is no rule."""
+    for pattern, retryPolicy in rules:
+        if pattern.match(fullCmd):
+            return retryPolicy
+
+    return RetryPolicy()
@@ -1,22 +1,75 @@
+import functools
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import spsaitActor.utils.retry as retry
 from spsaitActor.utils import cleanStr
+from spsaitActor.utils.durations import durationModel
 
 
 class SubCmd(object):
-    def __init__(self, actor, cmdStr, timeLim=300, tempo=5.0):
+    # long sequences hold hundreds of thousands of subCmds, no __dict__ and interned strings keep them small.
+    __slots__ = ('actor', 'cmdStr', 'timeLim', 'tempo', 'group', 'resources', 'retryPolicy', 'didFail', 'id',
+                 'stepId', 'cleanReply', 'visit', 'experiment')
+
+    # fallback tempo when no explicit tempo is given and no settle condition is available.
+    defaultTempo = 5.0
+    # one shared (actor,) tuple per actor.
+    defaultResources = dict()
+
+    def __init__(self, actor, cmdStr, timeLim=300, tempo=None, group=None, resources=None, retryPolicy=None):
         object.__init__(self)
-        self.actor = actor
-        self.cmdStr = cmdStr
+        self.actor = sys.intern(actor)
+        self.cmdStr = sys.intern(cmdStr)
         self.timeLim = timeLim
         self.tempo = tempo
+        self.group = group
+        # actors or devices locked by the experiment, another experiment cannot use them at the same time.
+        self.resources = SubCmd.defaultResources.setdefault(self.actor, (self.actor,)) if resources is None else \
+            tuple(resources)
+        if isinstance(retryPolicy, dict):
+            retryPolicy = retry.RetryPolicy(**retryPolicy)
+        self.retryPolicy = retry.policy(self.fullCmd) if retryPolicy is None else retryPolicy
         self.didFail = -1
         self.id = 0
+        self.stepId = 0
         self.cleanReply = ''
         self.visit = -1
+        self.experiment = None
+
+    @property
+    def isDone(self):
+        return self.didFail == 0
+
+    @property
+    def lane(self):
+        """Within a parallel group, subCmds sent to the same actor are still processed in order."""
+        return self.actor
 
     @property
     def fullCmd(self):
         return ('%s %s' % (self.actor, self.cmdStr)).strip()
 
+    def describe(self):
+        return dict(actor=self.actor, cmdStr=self.cmdStr, timeLim=self.timeLim, tempo=self.tempo, group=self.group,
+                    resources=list(self.resources), retryPolicy=self.retryPolicy.describe())
+
+    def restore(self, didFail, visit, cleanReply):
+        self.didFail = didFail
+        self.visit = visit
+        self.cleanReply = cleanReply
+
+    def update(self, didFail, cleanReply, visit=-1):
+        """Set the subCmd state, the experiment counters are updated on the way."""
+        wasCompleted = self.didFail != -1
+        self.restore(didFail=didFail, visit=visit, cleanReply=cleanReply)
+
+        if self.experiment is not None:
+            self.experiment.transition(self, wasCompleted=wasCompleted)
+
     def setId(self, experiment, cmdId):
         self.experiment = experiment
         self.id = cmdId
@@ -25,17 +78,58 @@ class SubCmd(object):
         return dict(actor=self.actor,
                     cmdStr=self.cmdStr,
                     forUserCmd=cmd,
-                    timeLim=self.timeLim)
+                    timeLim=durationModel.timeLim(self))
+
+    def callAndUpdate(self, cmd, interruptible=True):
+        """Call the subCmd, if interruptible an abort returns at once with cmdVar=None."""
+        actor = self.experiment.actor
+        self.experiment.journal.start(self)
+        start = time.time()
+
+        if not interruptible:
+            cmdVar = actor.cmdr.call(**(self.build(cmd=cmd)))
+            self.finish(cmd, cmdVar=cmdVar, start=start)
+            return cmdVar
+
+        # a late reply is only finished once the abort itself is, the actual result is the one which is kept.
+        aborted = threading.Event()
+
+        def onLate(lateVar):
+            aborted.wait()
+            self.finish(cmd, cmdVar=lateVar, start=start)
 
-    def callAndUpdate(self, cmd):
-        cmdVar = self.experiment.actor.cmdr.call(**(self.build(cmd=cmd)))
-        self.didFail = cmdVar.didFail
-        self.cleanReply = cleanStr(cmdVar.replyList[-1].keywords.canonical(delimiter=';'))
-        self.visit = self.getVisit(cmdVar)
+        try:
+            cmdVar = actor.interruptibleCall(isStopped=self.experiment.isStopped,
+                                             lateCalls=self.experiment.lateCalls,
+                                             onLate=onLate,
+                                             **(self.build(cmd=cmd)))
+            self.finish(cmd, cmdVar=cmdVar, start=start)
+        finally:
+            aborted.set()
 
-        self.inform(cmd=cmd)
         return cmdVar
 
+    def finish(self, cmd, cmdVar, start):
+        """Update, journal and publish the subCmd from its cmdVar, None if the call was aborted.
+
+        An aborted call is finished a second time with its actual cmdVar when it eventually returns.
+        """
+        if cmdVar is None:
+            self.update(didFail=1, cleanReply='aborted')
+        else:
+            self.update(didFail=cmdVar.didFail,
+                        cleanReply=cleanStr(cmdVar.replyList[-1].keywords.canonical(delimiter=';')),
+                        visit=self.getVisit(cmdVar))
+            if not self.didFail:
+                durationModel.record(self, duration=time.time() - start)
+
+        self.experiment.journal.finish(self)
+        self.experiment.publisher.publish(cmd, subCmd=self)
+
+        # the reply is journaled and published, it is only kept in memory for failures.
+        if not self.didFail:
+            self.cleanReply = ''
+
     def inform(self, cmd):
         cmd.inform('subCommand=%d,%d,"%s",%d,"%s"' % (self.experiment.id,
                                                       self.id,
@@ -45,7 +139,7 @@ class SubCmd(object):
 
     def getVisit(self, cmdVar):
         visit = -1
-        if not self.didFail:
+        if not cmdVar.didFail:
             try:
                 visit = int(cmdVar.replyList[-1].keywords['visit'].values[0])
             except KeyError:
@@ -55,6 +149,9 @@ class SubCmd(object):
 
 
 class CmdList(list):
+    groupIds = itertools.count(1)
+    group = None
+
     def __init__(self, cmdList=None):
         list.__init__(self)
         cmdList = [] if cmdList is None else cmdList
@@ -63,6 +160,14 @@ class CmdList(list):
             actor, cmdStr, timeLim = self.split(cmd)
             self.addSubCmd(actor=actor, cmdStr=cmdStr, timeLim=timeLim)
 
+    @classmethod
+    def fromDescriptions(cls, descriptions):
+        cmdList = cls()
+        for description in descriptions:
+            cmdList.append(SubCmd(**description))
+
+        return cmdList
+
     def split(self, cmd, timeLim=180):
         actor, cmdStr = cmd.split(' ', 1)
         args = cmdStr.split(' ')
@@ -73,6 +178,56 @@ class CmdList(list):
                 pass
         return actor, cmdStr, int(timeLim) + 120
 
-    def addSubCmd(self, actor, cmdStr, duplicate=1, timeLim=300, tempo=5.0):
+    @contextmanager
+    def parallel(self):
+        """SubCmds added within this block are processed concurrently, one lane per actor."""
+        self.group = next(CmdList.groupIds)
+        try:
+            yield self
+        finally:
+            self.group = None
+
+    def addSubCmd(self, actor, cmdStr, duplicate=1, timeLim=300, tempo=None, resources=None, retryPolicy=None):
         for i in range(duplicate):
-            self.append(SubCmd(actor=actor, cmdStr=cmdStr, timeLim=timeLim, tempo=tempo))
+            self.append(SubCmd(actor=actor, cmdStr=cmdStr, timeLim=timeLim, tempo=tempo, group=self.group,
+                               resources=resources, retryPolicy=retryPolicy))
+
+
+class LazyCmdList(object):
+    """Sequence whose subCmds are only built while it is iterated, its length is known without building them.
+
+    generator is called again for each iteration, so each pass yields new subCmds. recipe, if known, is the
+    controller call building the sequence, it is journaled instead of the subCmds themselves.
+    """
+
+    def __init__(self, generator, length, recipe=None):
+        object.__init__(self)
+        self.generator = generator
+        self.length = length
+        self.recipe = recipe
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        nSubCmds = 0
+        for subCmd in self.generator():
+            nSubCmds += 1
+            yield subCmd
+
+        if nSubCmds != self.length:
+            raise RuntimeError('sequence yielded %d subCmds, %d were expected' % (nSubCmds, self.length))
+
+
+def rebuildable(method):
+    """Controller method decorator, a lazy sequence keeps the call which built it so it can be built again."""
+
+    @functools.wraps(method)
+    def wrapper(self, **kwargs):
+        sequence = method(self, **kwargs)
+        if isinstance(sequence, LazyCmdList):
+            sequence.recipe = dict(controller=type(self).__name__, method=method.__name__, kwargs=kwargs)
+
+        return sequence
+
+    return wrapper
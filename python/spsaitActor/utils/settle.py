@@ -0,0 +1,46 @@
+import re
+
+
+class Condition(object):
+    """Tells when the hardware is ready after a subCmd, keyVars callbacks are used to wake up the waiting thread."""
+
+    def __init__(self, keyVars=None, isReady=None):
+        object.__init__(self)
+        self.keyVars = [] if keyVars is None else keyVars
+        self.isReady = (lambda: True) if isReady is None else isReady
+
+
+def immediate(subCmd, models):
+    """The command only returns once done, nothing to settle."""
+    return Condition()
+
+
+def slitIdle(subCmd, models):
+    keyVar = models[subCmd.actor].keyVarDict['slitFSM']
+    return Condition([keyVar], lambda: list(keyVar)[-1] == 'IDLE')
+
+
+def lampsOn(subCmd, models):
+    dcbKeys = models['dcb'].keyVarDict
+    lamps = re.search(r'on=(\S+)', subCmd.cmdStr).group(1).split(',')
+    keyVars = [dcbKeys[lamp] for lamp in lamps]
+    return Condition(keyVars, lambda: all([list(keyVar)[0] == 'on' for keyVar in keyVars]))
+
+
+rules = [(re.compile(r'^enu_sm\d+ slit'), slitIdle),
+         (re.compile(r'^dcb arc on='), lampsOn),
+         (re.compile(r'^dcb (status|mono|labsphere|arc off)'), immediate),
+         (re.compile(r'^sps expose'), immediate),
+         (re.compile(r'^sac ccd'), immediate)]
+
+
+def condition(subCmd, models):
+    """Return the settle condition of subCmd, None if there is no rule or if the keywords are not available."""
+    for pattern, rule in rules:
+        if pattern.match(subCmd.fullCmd):
+            try:
+                return rule(subCmd, models)
+            except (KeyError, AttributeError):
+                return None
+
+    return None
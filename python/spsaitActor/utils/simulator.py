@@ -0,0 +1,396 @@
+import argparse
+import configparser
+import importlib
+import json
+import math
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from spsaitActor.main import SpsaitActor
+from spsaitActor.utils.logbook import Logbook
+from spsaitActor.utils.planning import Planner
+from spsaitActor.utils.resources import ResourceManager
+from spsaitActor.utils.sequencing import LazyCmdList
+
+
+def lognormal(median, sigma):
+    """Latency distribution, median in seconds."""
+    return lambda rng: median * math.exp(rng.gauss(0, sigma))
+
+
+def constant(seconds):
+    return lambda rng: seconds
+
+
+# readout for sps exposures, the integration itself lasts exptime.
+defaultLatencies = [(r'^sps expose', lognormal(45, 0.05)),
+                    (r'^sps ', lognormal(1, 0.2)),
+                    (r'^enu_sm\d+ ', lognormal(6, 0.3)),
+                    (r'^dcb ', lognormal(2, 0.3)),
+                    (r'^xcu_\w+ ', lognormal(10, 0.3)),
+                    (r'^sac ', lognormal(3, 0.3))]
+
+
+class SimKeywords(OrderedDict):
+    def canonical(self, delimiter=';'):
+        return delimiter.join(['%s=%s' % (key, ','.join(map(str, value.values))) for key, value in self.items()])
+
+
+class SimValues(object):
+    def __init__(self, *values):
+        object.__init__(self)
+        self.values = list(values)
+
+
+class SimReply(object):
+    def __init__(self, keywords):
+        object.__init__(self)
+        self.keywords = keywords
+
+
+class SimCmdVar(object):
+    """Same shape as the cmdVar returned by cmdr.call."""
+
+    def __init__(self, didFail, keywords):
+        object.__init__(self)
+        self.didFail = didFail
+        self.replyList = [SimReply(keywords)]
+
+
+class SimKeyVar(list):
+    def __init__(self, values):
+        list.__init__(self, values)
+        self.callbacks = []
+
+    def addCallback(self, callback, callNow=False):
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback):
+        self.callbacks.remove(callback)
+
+    def set(self, *values):
+        self[:] = values
+        for callback in list(self.callbacks):
+            callback(self)
+
+
+class SimModel(object):
+    def __init__(self, keyVarDict):
+        object.__init__(self)
+        self.keyVarDict = keyVarDict
+
+
+class SimParsedCmd(object):
+    def __init__(self, keywords):
+        object.__init__(self)
+        self.keywords = keywords
+
+
+class SimCmd(object):
+    """User command, replies are only counted."""
+
+    def __init__(self, rawCmd='', keywords=None):
+        object.__init__(self)
+        self.rawCmd = rawCmd
+        self.cmd = SimParsedCmd(dict() if keywords is None else keywords)
+        self.replies = defaultdict(int)
+        self.warnings = []
+
+    def inform(self, response):
+        self.replies['inform'] += 1
+
+    def warn(self, response):
+        self.replies['warn'] += 1
+        self.warnings.append(response)
+
+    def finish(self, response=''):
+        self.replies['finish'] += 1
+
+    def fail(self, response=''):
+        self.replies['fail'] += 1
+
+
+class SimCmdr(object):
+    """Stand-in for the tron commander, cmdr.call sleeps a latency drawn for the command then replies.
+
+    :param latencies: [(regex on 'actor cmdStr', distribution)], first match wins, no match means no latency.
+    :param failures: [(regex, probability, reply text)] failure injection.
+    :param timeScale: every latency and exptime is multiplied by timeScale.
+    """
+
+    def __init__(self, latencies=None, failures=None, timeScale=1.0, seed=None):
+        object.__init__(self)
+        self.latencies = [(re.compile(pattern), dist) for pattern, dist in
+                          (defaultLatencies if latencies is None else latencies)]
+        self.failures = [(re.compile(pattern), prob, text) for pattern, prob, text in
+                         ([] if failures is None else failures)]
+        self.timeScale = timeScale
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.visit = 0
+        self.nCalls = 0
+        self.models = dict()
+
+    def draw(self, fullCmd):
+        with self.lock:
+            for pattern, dist in self.latencies:
+                if pattern.match(fullCmd):
+                    return dist(self.rng)
+
+        return 0
+
+    def fails(self, fullCmd):
+        with self.lock:
+            for pattern, probability, text in self.failures:
+                if pattern.match(fullCmd) and self.rng.random() < probability:
+                    return text
+
+        return None
+
+    def expose(self, cmdStr, readout):
+        """Drive ccd exposureState like the real cameras, integrating then reading."""
+        exptime = re.search(r'exptime=([\d.]+)', cmdStr)
+        exptime = float(exptime.group(1)) if exptime else 0
+        cams = re.search(r'cams?=(\S+)', cmdStr)
+        keyVars = [model.keyVarDict['exposureState'] for name, model in self.models.items() if
+                   name.startswith('ccd_') and (cams is None or name[4:] in cams.group(1).split(','))]
+
+        for keyVar in keyVars:
+            keyVar.set('integrating')
+        time.sleep(exptime * self.timeScale)
+
+        for keyVar in keyVars:
+            keyVar.set('reading')
+        time.sleep(readout * self.timeScale)
+
+        for keyVar in keyVars:
+            keyVar.set('idle')
+
+    def call(self, actor, cmdStr, forUserCmd=None, timeLim=None, **kwargs):
+        fullCmd = '%s %s' % (actor, cmdStr)
+        latency = self.draw(fullCmd)
+
+        if actor == 'sps' and cmdStr.startswith('expose'):
+            self.expose(cmdStr, readout=latency)
+        else:
+            time.sleep(latency * self.timeScale)
+
+        keywords = SimKeywords()
+        failure = self.fails(fullCmd)
+
+        with self.lock:
+            self.nCalls += 1
+            if failure is None and actor == 'sps' and cmdStr.startswith('expose'):
+                self.visit += 1
+                keywords['visit'] = SimValues(self.visit)
+
+        keywords['text'] = SimValues('"%s"' % ('OK' if failure is None else failure))
+        return SimCmdVar(didFail=failure is not None, keywords=keywords)
+
+
+class SimControllers(dict):
+    """Controllers of a SimActor, each one is only instantiated when first used."""
+
+    def __init__(self, actor):
+        dict.__init__(self)
+        self.actor = actor
+
+    def __missing__(self, name):
+        self[name] = self.actor.controller(name)
+        return self[name]
+
+
+class SimActor(SpsaitActor):
+    """SpsaitActor without the hub, logbook and journal are written in a sandbox directory.
+
+    Note that Logbook.path is changed for the whole process.
+    """
+
+    def __init__(self, cmdr, datadir=None, specIds=(1,), cams=('b1', 'r1'), pipelining=False, statusWindow=0,
+                 optimizeMoves=False):
+        self.name = 'spsait'
+        self.cmdr = cmdr
+        self.datadir = tempfile.mkdtemp(prefix='spsaitSim') if datadir is None else datadir
+
+        self.config = configparser.ConfigParser()
+        self.config.read_dict(dict(spsait=dict(datadir=self.datadir, specToAlign=str(specIds[0]),
+                                               cams=','.join(cams), pipelining=str(pipelining),
+                                               statusWindow=str(statusWindow), optimizeMoves=str(optimizeMoves))))
+        self.sandbox(self.datadir)
+
+        self.specIds = list(specIds)
+        self.enus = ['enu_sm%i' % specId for specId in self.specIds]
+        self.models = self.simModels()
+        cmdr.models = self.models
+
+        self.everConnected = True
+        self.controllers = SimControllers(self)
+        self.experiments = OrderedDict()
+        self.stopCondition = threading.Condition()
+        self.doStop = False
+        self.resources = ResourceManager(self.stopCondition)
+        self.planner = Planner()
+
+    @staticmethod
+    def sandbox(datadir):
+        Logbook.close()
+        Logbook.path = datadir
+        Logbook.nextExperimentIds.clear()
+
+        for dbname in ['experimentLog', 'experimentLog-sac']:
+            conn = sqlite3.connect(Logbook.filepath(dbname))
+            with conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS Experiment (experimentId INTEGER PRIMARY KEY, name TEXT,
+                                visitStart INTEGER, visitEnd INTEGER, seqtype TEXT, cmdStr TEXT, comments TEXT,
+                                anomalies TEXT, startdate TEXT, cmdError TEXT)""")
+            conn.close()
+
+    def simModels(self):
+        models = dict()
+        for enu in self.enus:
+            models[enu] = SimModel(dict(slit=SimKeyVar([0.] * 6), slitFSM=SimKeyVar(['IDLE'])))
+
+        models['dcb'] = SimModel(defaultdict(lambda: SimKeyVar(['on'])))
+
+        for cam in self.cams:
+            models['ccd_%s' % cam] = SimModel(dict(exposureState=SimKeyVar(['idle'])))
+
+        return models
+
+    def controller(self, name):
+        """Controller instance which only builds sequences, its thread is never started."""
+        module = importlib.import_module('spsaitActor.Controllers.%s' % name)
+        controller = object.__new__(getattr(module, name))
+        controller.actor = self
+        return controller
+
+    def strTraceback(self, e):
+        return str(e)
+
+
+# name: (controller, method, kwargs, seqtype)
+scenarios = OrderedDict(
+    biases=('calib', 'biases', dict(duplicate=10, cams=False), 'biases'),
+    darks=('calib', 'darks', dict(duplicate=5, exptime=300, cams=False), 'darks'),
+    arcs=('expose', 'arcs', dict(exptype='arc', exptime=2, duplicate=10, cams=False), 'arcs'),
+    imstab=('calib', 'imstab', dict(exptime=2, duration=1, delay=0.25, duplicate=1, cams=False, keepOn=False,
+                                    switchOn=['neon'], attenuator='', force=''), 'imageStability'),
+    slitTF=('align', 'slitTF', dict(exptime=2, positions=[-0.5 + 0.1 * i for i in range(11)], cams=False,
+                                    duplicate=1), 'slitThroughFocus'),
+    ditherflat=('dither', 'ditherflat', dict(exptime=2, cams=False, shift=0.1, nbPosition=5, duplicate=1),
+                'ditheredFlats'),
+    ditherpsf=('dither', 'ditherpsf', dict(exptime=2, cams=False, shift=0.5, doMinus=True, duplicate=1),
+               'ditheredPsf'),
+    defocus=('defocus', 'defocus', dict(exptime=2, positions=[-4 + i for i in range(9)], attenuator=None,
+                                        cams=False, duplicate=1), 'defocusedPsf'),
+)
+
+
+def runScenario(name, cmdr, pipelining=False, statusWindow=0, optimizeMoves=False, abortAfter=None):
+    """Process one scenario, return its number of subCmds, informs and wall time, and abort latency if requested."""
+    ctrlName, method, kwargs, seqtype = scenarios[name]
+    actor = SimActor(cmdr, pipelining=pipelining, statusWindow=statusWindow, optimizeMoves=optimizeMoves)
+    sequence = getattr(actor.controller(ctrlName), method)(**kwargs)
+
+    # explicit tempos are scaled like every other duration, a lazy sequence is scaled while it is built.
+    def scaled(subCmds):
+        for subCmd in subCmds:
+            subCmd.tempo = None if subCmd.tempo is None else subCmd.tempo * cmdr.timeScale
+            yield subCmd
+
+    if isinstance(sequence, LazyCmdList):
+        sequence = LazyCmdList(lambda generator=sequence.generator: scaled(generator()), length=len(sequence))
+    else:
+        sequence = list(scaled(sequence))
+
+    cmd = SimCmd(rawCmd='%s %s' % (ctrlName, method))
+    result = dict(scenario=name, nSubCmds=len(sequence))
+
+    if abortAfter is not None:
+        def abort():
+            time.sleep(abortAfter)
+            result['abortTime'] = time.time()
+            actor.abort()
+
+        threading.Thread(target=abort, daemon=True).start()
+
+    start = time.time()
+    try:
+        actor.processSequence(cmd, sequence, seqtype=seqtype, name='simulation', comments='')
+    except RuntimeError:
+        pass
+
+    end = time.time()
+    result['wall'] = end - start
+    result['informs'] = cmd.replies['inform']
+    if 'abortTime' in result:
+        result['abortLatency'] = end - result.pop('abortTime')
+
+    Logbook.close()
+    return result
+
+
+def benchmark(names=None, timeScale=0.01, abortAfter=0.2, pipelining=False, statusWindow=0, optimizeMoves=False,
+              seed=0):
+    """Report throughput (subCmds/s with the latency model), per-step overhead (zero latency) and abort latency."""
+    results = []
+    for name in (scenarios.keys() if names is None else names):
+        try:
+            timed = runScenario(name, SimCmdr(timeScale=timeScale, seed=seed), pipelining=pipelining,
+                                statusWindow=statusWindow, optimizeMoves=optimizeMoves)
+            bare = runScenario(name, SimCmdr(latencies=[], timeScale=0, seed=seed), pipelining=pipelining,
+                               optimizeMoves=optimizeMoves)
+            aborted = runScenario(name, SimCmdr(timeScale=timeScale, seed=seed), pipelining=pipelining,
+                                  optimizeMoves=optimizeMoves, abortAfter=abortAfter)
+        except ImportError as e:
+            results.append(dict(scenario=name, error=str(e)))
+            continue
+
+        results.append(dict(scenario=name,
+                            nSubCmds=timed['nSubCmds'],
+                            wall=timed['wall'],
+                            informs=timed['informs'],
+                            throughput=timed['nSubCmds'] / timed['wall'],
+                            stepOverhead=bare['wall'] / bare['nSubCmds'],
+                            abortLatency=aborted.get('abortLatency', float('nan'))))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scenarios', nargs='*', default=None, help='scenarios to run, all by default')
+    parser.add_argument('--timeScale', default=0.01, type=float, help='latency and exptime scale factor')
+    parser.add_argument('--abortAfter', default=0.2, type=float, help='abort delay in seconds')
+    parser.add_argument('--pipelining', action='store_true', help='overlap moves and readout')
+    parser.add_argument('--statusWindow', default=0, type=float, help='subCommand and status coalescing window')
+    parser.add_argument('--optimizeMoves', action='store_true', help='send the minimal slit moves')
+    parser.add_argument('--seed', default=0, type=int, help='random seed')
+    parser.add_argument('--json', default=None, type=str, help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = benchmark(names=args.scenarios if args.scenarios else None, timeScale=args.timeScale,
+                        abortAfter=args.abortAfter, pipelining=args.pipelining, statusWindow=args.statusWindow,
+                        optimizeMoves=args.optimizeMoves, seed=args.seed)
+
+    print('%-12s %8s %8s %10s %14s %16s %14s' % ('scenario', 'subCmds', 'informs', 'wall(s)', 'subCmds/s',
+                                                  'overhead(ms)', 'abort(ms)'))
+    for res in results:
+        if 'error' in res:
+            print('%-12s skipped : %s' % (res['scenario'], res['error']))
+            continue
+        print('%-12s %8d %8d %10.2f %14.1f %16.2f %14.1f' % (res['scenario'], res['nSubCmds'], res['informs'],
+                                                             res['wall'], res['throughput'],
+                                                             1000 * res['stepOverhead'], 1000 * res['abortLatency']))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import re
+
+slitActor = re.compile(r'^enu_sm\d+$')
+slitRelative = re.compile(r'^slit (shift|dither)=([-\d.]+) pixels$')
+slitAbsolute = re.compile(r'^slit move absolute (.+)$')
+
+
+def isSlitMove(subCmd):
+    return slitActor.match(subCmd.actor) is not None and subCmd.cmdStr.startswith('slit ')
+
+
+def isAnchor(subCmd):
+    """home and absolute moves set the whole slit position, whatever it was before."""
+    return subCmd.cmdStr == 'slit home' or slitAbsolute.match(subCmd.cmdStr) is not None
+
+
+def replayFrom(subCmds, first, done):
+    """Per slit actor, id of its last home or absolute move before the first subCmd which is not done.
+
+    When resuming, the slit moves from there are sent again, the slit position is not known after a restart.
+    Raise if a slit actor made relative moves before any home or absolute move, its position cannot be rebuilt.
+    """
+    resumeAt = first
+    while resumeAt in done:
+        resumeAt += 1
+
+    anchors = dict()
+    for cmdId, subCmd in enumerate(subCmds, start=first):
+        if cmdId >= resumeAt:
+            break
+
+        if not isSlitMove(subCmd):
+            continue
+
+        if isAnchor(subCmd):
+            anchors[subCmd.actor] = cmdId
+        elif subCmd.actor not in anchors:
+            raise RuntimeError('%s position before %s is unknown, the sequence cannot be resumed' % (subCmd.actor,
+                                                                                                    subCmd.cmdStr))
+
+    return anchors
@@ -22,8 +22,12 @@ def locate(seqtype):
     return location[seqtype]
 
 
+def databases():
+    return sorted(set(location.values()))
+
+
 def guess(subCmds):
-    if True in [subCmd.actor == 'sac' for subCmd in subCmds]:
+    if any(subCmd.actor == 'sac' for subCmd in subCmds):
         return 'experimentLog-sac'
 
     return 'experimentLog'